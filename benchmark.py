@@ -0,0 +1,304 @@
+import argparse
+import csv
+import datetime
+import itertools
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import database
+import fleet
+import importer
+from utils import (URGENT_DAYS, WARNING_DAYS, create_expiry_timeline,
+                   create_status_chart, documents_frame,
+                   get_document_notifications, vehicles_frame)
+
+FLEET_SIZES = (10_000, 100_000)
+REPEAT = 3
+SEED = 1234
+# A benchmark regresses when its median is both TOLERANCE slower than the
+# baseline and at least NOISE_FLOOR seconds slower.
+TOLERANCE = 0.25
+NOISE_FLOOR = 0.005
+# Absolute budgets in seconds, checked on every run and by
+# tests/test_app.py: a fresh process drawing the dashboard, and switching
+# to a page of the running app.
+TARGETS = {"cold_start": 3.0, "rerun": 1.5}
+APP_SCRIPT = Path(__file__).with_name("streamlit_app.py")
+COLD_START_CODE = """
+import pathlib, sys
+import database
+database.DB_FILE = pathlib.Path(sys.argv[1])
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file(sys.argv[2], default_timeout=600).run()
+if app.exception:
+    sys.exit(app.exception[0].value)
+"""
+
+VEHICLE_MODELS = [
+    "تويوتا كامري", "تويوتا كورولا", "تويوتا لاندكروزر", "تويوتا هايلكس",
+    "هيونداي النترا", "هيونداي سوناتا", "هيونداي أكسنت", "نيسان صني",
+    "نيسان باترول", "كيا سيراتو", "كيا سبورتاج", "شيفروليه تاهو",
+    "فورد إكسبلورر", "جي إم سي يوكن", "مازدا 6", "إيسوزو دي ماكس",
+]
+PLATE_LETTERS = "ابحدرسصطعقكلمنهوى"
+SEARCH_TERMS = ["تويوتا", "كامري", "1234", "ب ح"]
+
+
+def _plate(index):
+    number = index % 9999 + 1
+    index //= 9999
+    letters = []
+    for _ in range(3):
+        index, digit = divmod(index, len(PLATE_LETTERS))
+        letters.append(PLATE_LETTERS[digit])
+    return f"{' '.join(letters)} {number}"
+
+
+def _expiry_offset(rng):
+    # Most documents are renewed well ahead of time, a long tail sits far in
+    # the future and a minority has already lapsed.
+    if rng.random() < 0.12:
+        return -int(rng.expovariate(1 / 60)) - 1
+    return min(int(rng.expovariate(1 / 150)), 3 * 365)
+
+
+def generate_fleet(size, seed=SEED, today=None):
+    today = today or datetime.date.today()
+    rng = random.Random(seed)
+    for index in range(size):
+        reg = today + datetime.timedelta(days=_expiry_offset(rng))
+        ins = reg + datetime.timedelta(days=rng.randint(-90, 270))
+        name = f"{rng.choice(VEHICLE_MODELS)} {rng.randint(2010, 2026)}"
+        yield name, _plate(index), reg.isoformat(), ins.isoformat()
+
+
+def _write_csv(path, rows):
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["اسم السيارة", "رقم اللوحة", "انتهاء الاستمارة",
+                         "انتهاء التأمين"])
+        writer.writerows(rows)
+
+
+def _use_database(path):
+    database.close_all_connections()
+    database.DB_FILE = Path(path)
+    database.initialize()
+
+
+def _measure(func, repeat, setup=None):
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        database.invalidate_cache()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {"min": min(timings), "median": statistics.median(timings),
+            "runs": len(timings)}
+
+
+def _benchmarks(workdir, csv_path, today):
+    from streamlit.testing.v1 import AppTest
+    horizon = today + datetime.timedelta(days=WARNING_DAYS)
+    thresholds = (WARNING_DAYS, URGENT_DAYS, -1)
+    # The notifier's incremental scan: one day since the last run, with no
+    # vehicles written in between.
+    last_scan = (today - datetime.timedelta(days=1), database.sync_version())
+    # A copy of the snapshot frame, which the output cache does not key,
+    # so the chart benchmarks draw rather than hit the cache.
+    state = {"df": vehicles_frame(database.get_all_vehicles()),
+             "frame": fleet.FleetSnapshot.load().frame().copy(),
+             "documents": documents_frame(
+                 database.get_expiring_documents(None, horizon))}
+    import_dbs = itertools.count()
+    app = AppTest.from_file(str(APP_SCRIPT), default_timeout=600)
+
+    def load_frame():
+        state["df"] = vehicles_frame(database.get_all_vehicles())
+
+    def backup():
+        state["backup"] = database.backup_data("ndjson", directory=workdir)
+
+    def prepare_restore():
+        if "backup" not in state:
+            backup()
+
+    def restore():
+        database.restore_data(state["backup"], policy="replace")
+
+    def cold_start():
+        done = subprocess.run([sys.executable, "-c", COLD_START_CODE,
+                               str(database.DB_FILE), str(APP_SCRIPT)],
+                              cwd=APP_SCRIPT.parent, capture_output=True,
+                              text=True)
+        if done.returncode:
+            raise RuntimeError(done.stderr.strip()[-500:])
+
+    def open_page(page):
+        app.sidebar.radio[0].set_value(page).run()
+        if app.exception:
+            raise RuntimeError(app.exception[0].value)
+
+    def fresh_database():
+        _use_database(workdir / f"import{next(import_dbs)}.db")
+
+    yield "get_all_vehicles", None, database.get_all_vehicles
+    for term in SEARCH_TERMS:
+        yield f"search_vehicles[{term}]", None, \
+            lambda term=term: database.search_vehicles(term)
+    for status in ("expired", "near_expiry", "valid"):
+        yield f"get_vehicles_by_status[{status}]", None, \
+            lambda status=status: database.get_vehicles_by_status(status)
+    yield "get_status_summary", None, database.get_status_summary
+    for order_by, status in (("name", None), ("name", "expired"),
+                             ("name", "valid"),
+                             ("earliest_expiry", "near_expiry")):
+        yield f"list_vehicles[{order_by},{status or 'all'}]", None, \
+            lambda order_by=order_by, status=status: database.list_vehicles(
+                None, database.PAGE_SIZE, order_by, status)
+    yield "find_expiring_documents[full]", None, \
+        lambda: database.find_expiring_documents(today, thresholds)
+    yield "find_expiring_documents[incremental]", None, \
+        lambda: database.find_expiring_documents(today, thresholds, last_scan)
+    yield "get_expiring_documents", None, \
+        lambda: database.get_expiring_documents(
+            today, today + datetime.timedelta(days=30))
+    yield "vehicles_frame", None, load_frame
+    yield "fleet_snapshot", None, fleet.FleetSnapshot.load
+    yield "snapshot_frame", None, lambda: fleet.FleetSnapshot.load().frame()
+    yield "get_document_notifications", None, \
+        lambda: get_document_notifications(state["documents"], today=today)
+    yield "create_status_chart", None, \
+        lambda: create_status_chart(state["frame"])
+    yield "create_expiry_timeline", None, \
+        lambda: create_expiry_timeline(state["frame"])
+    yield "backup_data", None, backup
+    yield "restore_data", prepare_restore, restore
+    yield "cold_start", None, cold_start
+    for page in app.run().sidebar.radio[0].options:
+        yield f"rerun[{page}]", None, lambda page=page: open_page(page)
+    # Last, because it moves the process to a fresh database per run.
+    yield "import_vehicles", fresh_database, \
+        lambda: importer.import_vehicles(str(csv_path), kind="csv")
+
+
+def run_benchmarks(sizes=FLEET_SIZES, repeat=REPEAT, seed=SEED, only=None,
+                   log=None):
+    today = datetime.date.today()
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            workdir = Path(tmp)
+            csv_path = workdir / "fleet.csv"
+            _write_csv(csv_path, generate_fleet(size, seed, today))
+            _use_database(workdir / "fleet.db")
+            database.bulk_add_vehicles(generate_fleet(size, seed, today))
+            for name, setup, func in _benchmarks(workdir, csv_path, today):
+                if only and name.split("[")[0] not in only:
+                    continue
+                result = {"size": size, "name": name}
+                try:
+                    result.update(_measure(func, repeat, setup))
+                except Exception as e:
+                    message = " ".join(str(e).split())
+                    result["error"] = f"{type(e).__name__}: {message}"
+                target = TARGETS.get(name.split("[")[0])
+                if target is not None and "median" in result:
+                    result["target"] = target
+                results.append(result)
+                if log is not None:
+                    log(_format_result(result))
+            database.close_all_connections()
+    return {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": database.sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "seed": seed,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def _format_result(result):
+    label = f"{result['size']:>9} {result['name']:<44}"
+    if "error" in result:
+        return f"{label} ERROR {result['error'][:80]}"
+    line = f"{label} {result['median'] * 1000:>10.1f} ms"
+    if result["median"] > result.get("target", float("inf")):
+        line += "  OVER TARGET"
+    return line
+
+
+def compare(current, baseline, tolerance=TOLERANCE, noise_floor=NOISE_FLOOR):
+    previous = {(r["size"], r["name"]): r for r in baseline["results"]}
+    report = []
+    for result in current["results"]:
+        before = previous.get((result["size"], result["name"]))
+        if before is None or "median" not in before or "median" not in result:
+            continue
+        ratio = result["median"] / before["median"] if before["median"] else 1.0
+        regressed = (ratio > 1 + tolerance
+                     and result["median"] - before["median"] > noise_floor)
+        report.append({"size": result["size"], "name": result["name"],
+                       "baseline": before["median"],
+                       "median": result["median"], "ratio": ratio,
+                       "regressed": regressed})
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="قياس أداء المسارات الرئيسية على أسطول اصطناعي")
+    parser.add_argument("--sizes", type=int, nargs="+", default=FLEET_SIZES,
+                        help="أحجام الأسطول، مثل 10000 100000 1000000")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--only", action="append", default=[],
+                        help="تشغيل قياس محدد فقط (قابل للتكرار)")
+    parser.add_argument("--output", help="حفظ النتائج بصيغة JSON")
+    parser.add_argument("--baseline", help="ملف نتائج سابق للمقارنة")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="نسبة التباطؤ المسموحة قبل اعتباره تراجعاً")
+    args = parser.parse_args(argv)
+
+    def log(line):
+        print(line, file=sys.stderr, flush=True)
+
+    results = run_benchmarks(args.sizes, args.repeat, args.seed,
+                             set(args.only), log)
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+    else:
+        print(text)
+
+    status = 0
+    if any("error" in result or result["median"] > result.get(
+            "target", float("inf")) for result in results["results"]):
+        status = 1
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        for row in compare(results, baseline, args.tolerance):
+            flag = "REGRESSION" if row["regressed"] else "ok"
+            log(f"{row['size']:>9} {row['name']:<44} "
+                f"{row['baseline'] * 1000:>10.1f} -> "
+                f"{row['median'] * 1000:>10.1f} ms  x{row['ratio']:.2f}  {flag}")
+            if row["regressed"]:
+                status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+import functools
+import threading
+from collections import OrderedDict
+
+CACHE_SIZE = 256
+
+_MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def memoize(cache, key_func):
+    # key_func returns None (or something unhashable) to bypass the cache.
+    # Cached values are shared by every caller and must be treated as
+    # read-only.
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = key_func(func, args, kwargs)
+            try:
+                value = _MISSING if key is None else cache.get(key, _MISSING)
+            except TypeError:
+                key = None
+                value = _MISSING
+            if value is _MISSING:
+                value = func(*args, **kwargs)
+                if key is not None:
+                    cache.put(key, value)
+            return value
+        return wrapper
+    return decorator
@@ -1,148 +1,1868 @@
 
+import atexit
+import itertools
+import logging
+import queue
 import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
 from pathlib import Path
 import datetime
 
+from cache import LRUCache, memoize
+from metrics import instrument, trace_statement
+
 DB_FILE = Path("vehicle_expirations.db")
 
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = 8
+BUSY_TIMEOUT_MS = 5000
+# How long a caller waits for its write to start before giving up with
+# DatabaseBusyError.
+WRITE_TIMEOUT_MS = 30000
+MMAP_SIZE = 256 * 1024 * 1024
+STATEMENT_CACHE_SIZE = 256
+WRITE_BATCH_SIZE = 64
+
+NEAR_EXPIRY_DAYS = 30
+ARCHIVE_AFTER_DAYS = 365
+SEARCH_LIMIT = 100
+PAGE_SIZE = 50
+
+BACKUP_FORMATS = ("json", "ndjson", "sqlite")
+BACKUP_COMPRESSIONS = (None, "gzip", "zstd")
+RESTORE_POLICIES = ("skip", "merge", "replace")
+# Accepted by parse_dates for imported and migrated dates, in this order.
+DATE_FORMATS = ("ISO8601", "%d/%m/%Y", "%d-%m-%Y")
+_ARCHIVE_BACKUP_FIELDS = ("vehicle_id", "name", "plate_number",
+                          "registration_expiry", "insurance_expiry",
+                          "documents", "updated_at", "archived_at", "reason")
+_NOW_SQL = "strftime('%Y-%m-%dT%H:%M:%f', 'now')"
+
+# Expiry dates are stored as days since 1970-01-01.
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+MIN_DAY = datetime.date.min.toordinal() - _EPOCH_ORDINAL
+MAX_DAY = datetime.date.max.toordinal() - _EPOCH_ORDINAL
+_NO_EXPIRY_DAY = MAX_DAY + 1
+LIST_ORDER_COLUMNS = ("name", "plate_number", "earliest_expiry")
+DOCUMENT_TYPES = ("registration", "insurance", "inspection", "operating_card",
+                  "driver_permit")
+# Document types still stored as vehicles columns; triggers mirror them
+# into documents.
+_VEHICLE_DOCUMENT_COLUMNS = {"registration": "registration_expiry",
+                             "insurance": "insurance_expiry"}
+
+# Letter forms that should match each other when searching, plus
+# diacritics and tatweel which are dropped entirely.
+_SEARCH_NORMALIZATION = {
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ة": "ه", "ى": "ي",
+    "٠": "0", "١": "1", "٢": "2", "٣": "3", "٤": "4",
+    "٥": "5", "٦": "6", "٧": "7", "٨": "8", "٩": "9",
+    "ـ": "", "\u064b": "", "\u064c": "", "\u064d": "", "\u064e": "",
+    "\u064f": "", "\u0650": "", "\u0651": "", "\u0652": "",
+}
+_SEARCH_TABLE = str.maketrans(_SEARCH_NORMALIZATION)
+_PLATE_SEPARATORS = (" ", "-")
+
+_pool = []
+_pool_lock = threading.Lock()
+
+_watch = None
+_watch_lock = threading.Lock()
+_write_generation = 0
+_query_cache = LRUCache()
+# Database files already migrated by this process.
+_initialized = set()
+
+
+class _TracedConnection(sqlite3.Connection):
+    # Reports statements to metrics without sqlite3's trace callback, which
+    # also fires for every trigger and FTS statement and expands parameters.
+    def execute(self, sql, *args):
+        trace_statement(sql)
+        return super().execute(sql, *args)
 
+    def executemany(self, sql, *args):
+        trace_statement(sql)
+        return super().executemany(sql, *args)
+
+
+def _open_conn(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000,
+                           check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE,
+                           factory=_TracedConnection)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    return conn
+
+
+def _acquire_conn():
+    path = str(DB_FILE)
+    stale = []
+    conn = None
+    with _pool_lock:
+        while _pool:
+            pooled_path, pooled = _pool.pop()
+            if pooled_path == path:
+                conn = pooled
+                break
+            stale.append(pooled)
+    for pooled in stale:
+        pooled.close()
+    return path, conn or _open_conn(path)
+
+
+def _release_conn(path, conn):
+    if conn.in_transaction:
+        conn.rollback()
+    with _pool_lock:
+        if len(_pool) < POOL_SIZE and path == str(DB_FILE):
+            _pool.append((path, conn))
+            return
+    conn.close()
+
+
+@contextmanager
 def get_conn():
-    return sqlite3.connect(DB_FILE)
+    path, conn = _acquire_conn()
+    try:
+        with conn:
+            yield conn
+    finally:
+        _release_conn(path, conn)
+
+
+class DatabaseError(ValueError):
+    pass
+
+
+class DuplicatePlateError(DatabaseError):
+    def __init__(self, message="رقم اللوحة موجود مسبقاً"):
+        super().__init__(message)
+
+
+class VehicleNotFoundError(DatabaseError):
+    def __init__(self, message="السيارة غير موجودة"):
+        super().__init__(message)
+
+
+class DatabaseBusyError(DatabaseError):
+    def __init__(self, message="قاعدة البيانات مشغولة، حاول مرة أخرى"):
+        super().__init__(message)
+
+
+def _typed_error(error):
+    if isinstance(error, sqlite3.OperationalError) and (
+            "locked" in str(error) or "busy" in str(error)):
+        return DatabaseBusyError()
+    if (isinstance(error, sqlite3.IntegrityError)
+            and "vehicles.plate_number" in str(error)):
+        return DuplicatePlateError()
+    return error
+
+
+class _Writer:
+    # Every mutation goes through one thread and one connection. Queued
+    # operations are committed together, each inside its own savepoint so
+    # a failing one does not undo the others; futures resolve only after
+    # the commit. Exclusive operations (bulk imports, restores) run alone
+    # and manage their own commits.
+    _CLOSE = object()
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._conn = None
+        self._held = None
+
+    def submit(self, func, args=(), exclusive=False):
+        future = Future()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="database-writer", daemon=True)
+                self._thread.start()
+            self._queue.put((func, args, exclusive, future))
+        return future
+
+    def close(self):
+        # Stops the thread once the operations queued before the call are
+        # done; the next submit starts a new one.
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                return
+            self._queue.put((self._CLOSE, (), True, Future()))
+            self._thread.join()
+            self._thread = None
+
+    def _connection(self):
+        path = str(DB_FILE)
+        if self._conn is None or self._conn[0] != path:
+            if self._conn is not None:
+                self._conn[1].close()
+            self._conn = (path, _open_conn(path))
+        return self._conn[1]
+
+    def _next_batch(self):
+        first = self._held or self._queue.get()
+        self._held = None
+        batch = [first]
+        while not first[2] and len(batch) < WRITE_BATCH_SIZE:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[2]:
+                self._held = item
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            # Operations whose caller gave up waiting were cancelled and
+            # are dropped here.
+            batch = [item for item in self._next_batch()
+                     if item[3].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            if batch[0][0] is self._CLOSE:
+                if self._conn is not None:
+                    self._conn[1].close()
+                    self._conn = None
+                batch[0][3].set_result(None)
+                return
+            try:
+                if batch[0][2]:
+                    self._run_exclusive(*batch[0])
+                else:
+                    self._run_group(batch)
+            except BaseException as e:
+                for _, _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(_typed_error(e))
+
+    def _run_exclusive(self, func, args, exclusive, future):
+        conn = self._connection()
+        try:
+            result = func(conn, *args)
+            conn.commit()
+        except BaseException as e:
+            conn.rollback()
+            future.set_exception(_typed_error(e))
+        else:
+            future.set_result(result)
+        finally:
+            invalidate_cache()
+
+    def _run_group(self, batch):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        outcomes = []
+        try:
+            for func, args, _, future in batch:
+                conn.execute("SAVEPOINT write_op")
+                try:
+                    outcomes.append((future, True, func(conn, *args)))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write_op")
+                    outcomes.append((future, False, _typed_error(e)))
+                conn.execute("RELEASE write_op")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            invalidate_cache()
+        for future, ok, value in outcomes:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+
+_writer = _Writer()
+
+
+def _write(func, args, wait, exclusive=False):
+    future = _writer.submit(func, args, exclusive)
+    if not wait:
+        return future
+    try:
+        return future.result(WRITE_TIMEOUT_MS / 1000)
+    except TimeoutError:
+        # Still queued: withdraw it so it never runs. Once started it is
+        # waited for, since it may already have written.
+        if future.cancel():
+            raise DatabaseBusyError()
+        return future.result()
+
+
+def close_all_connections():
+    global _watch
+    _writer.close()
+    with _pool_lock:
+        pooled = [conn for _, conn in _pool]
+        _pool.clear()
+    with _watch_lock:
+        if _watch is not None:
+            pooled.append(_watch[1])
+            _watch = None
+    for conn in pooled:
+        conn.close()
+    _initialized.clear()
+
+
+@instrument
+def data_version():
+    # PRAGMA data_version on a connection that never writes changes
+    # whenever any other connection (in this or another process) commits.
+    global _watch
+    path = str(DB_FILE)
+    with _watch_lock:
+        if _watch is None or _watch[0] != path:
+            if _watch is not None:
+                _watch[1].close()
+            _watch = (path, sqlite3.connect(path, check_same_thread=False,
+                                            factory=_TracedConnection))
+        version = _watch[1].execute("PRAGMA data_version").fetchone()[0]
+    return path, version, _write_generation
+
+
+def invalidate_cache():
+    global _write_generation
+    _write_generation += 1
+    _query_cache.clear()
+
+
+def _query_key(func, args, kwargs):
+    return (func.__name__, args, tuple(sorted(kwargs.items())),
+            data_version(), datetime.date.today())
+
+
+_cached_query = memoize(_query_cache, _query_key)
+
+
+atexit.register(close_all_connections)
+
+
+def _create_vehicle_indexes(conn):
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_vehicles_updated_at
+                 ON vehicles (updated_at)""")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_vehicles_name
+                 ON vehicles (name)""")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_vehicles_registration_expiry
+                 ON vehicles (registration_expiry)""")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_vehicles_insurance_expiry
+                 ON vehicles (insurance_expiry)""")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_vehicles_earliest_expiry
+                 ON vehicles (earliest_expiry)""")
+
+
+def _migrate_baseline(conn):
+    # Brings databases created before user_version was tracked (including
+    # the original two-column schema) up to a common starting point.
+    conn.execute("""CREATE TABLE IF NOT EXISTS vehicles (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        plate_number TEXT UNIQUE,
+        registration_expiry TEXT,
+        insurance_expiry TEXT
+    )""")
+    columns = {row[1] for row in
+               conn.execute("PRAGMA table_xinfo(vehicles)")}
+    if "earliest_expiry" not in columns:
+        conn.execute("""ALTER TABLE vehicles ADD COLUMN earliest_expiry TEXT
+                     GENERATED ALWAYS AS (
+                         min(coalesce(registration_expiry, insurance_expiry),
+                             coalesce(insurance_expiry, registration_expiry))
+                     ) VIRTUAL""")
+    if "updated_at" not in columns:
+        conn.execute("ALTER TABLE vehicles ADD COLUMN updated_at TEXT")
+    conn.execute("""CREATE TABLE IF NOT EXISTS backups (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        started_at TEXT NOT NULL,
+        file TEXT NOT NULL,
+        format TEXT NOT NULL,
+        incremental INTEGER NOT NULL
+    )""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS scan_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        scan_date TEXT NOT NULL,
+        started_at TEXT NOT NULL
+    )""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS notification_log (
+        plate_number TEXT NOT NULL,
+        document TEXT NOT NULL,
+        level TEXT NOT NULL,
+        expiry TEXT NOT NULL,
+        sent_at TEXT NOT NULL,
+        PRIMARY KEY (plate_number, document, level, expiry)
+    ) WITHOUT ROWID""")
+    _create_vehicle_indexes(conn)
+    _create_search_index(conn)
+
+
+def _day_check(column):
+    return (f"CHECK ({column} IS NULL OR (typeof({column}) = 'integer' "
+            f"AND {column} BETWEEN {MIN_DAY} AND {MAX_DAY}))")
+
+
+def _text_to_day_sql(column):
+    return (f"CASE WHEN typeof({column}) = 'text' AND date({column}) IS NOT NULL "
+            f"THEN CAST(julianday(date({column})) - 2440587.5 AS INTEGER) END")
+
+
+def _day_to_text_sql(column):
+    return f"date({column} * 86400, 'unixepoch')"
+
+
+def _migrate_text_dates(conn, column):
+    # Second pass over the dates SQLite could not read, with DATE_FORMATS.
+    # Returns the (id, plate, column, text) rows that still fail.
+    rows = conn.execute(f"""SELECT old.id, old.plate_number, old.{column}
+                        FROM vehicles old JOIN vehicles_new new USING (id)
+                        WHERE new.{column} IS NULL
+                        AND old.{column} IS NOT NULL""").fetchall()
+    texts = [str(value).strip() for _, _, value in rows]
+    days = []
+    rejected = []
+    for (vehicle_id, plate, _), text, date in zip(rows, texts,
+                                                 parse_dates(texts)):
+        if not text or text in _MISSING_TEXT:
+            continue
+        if date is None:
+            rejected.append((vehicle_id, plate, column, text))
+        else:
+            days.append((_to_day(date), vehicle_id))
+    conn.executemany(f"UPDATE vehicles_new SET {column} = ? WHERE id = ?",
+                     days)
+    return rejected
+
+
+def _migrate_epoch_days(conn):
+    # Expiry dates become integer days since 1970-01-01. Strings that no
+    # known format reads are stored as NULL and their original text is
+    # kept in rejected_expiry_dates.
+    conn.execute(f"""CREATE TABLE vehicles_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        plate_number TEXT NOT NULL UNIQUE,
+        registration_expiry INTEGER {_day_check("registration_expiry")},
+        insurance_expiry INTEGER {_day_check("insurance_expiry")},
+        updated_at TEXT,
+        earliest_expiry INTEGER GENERATED ALWAYS AS (
+            min(coalesce(registration_expiry, insurance_expiry),
+                coalesce(insurance_expiry, registration_expiry))
+        ) VIRTUAL
+    )""")
+    conn.execute(f"""INSERT INTO vehicles_new
+                 (id, name, plate_number, registration_expiry,
+                  insurance_expiry, updated_at)
+                 SELECT id, coalesce(name, ''), coalesce(plate_number, '#' || id),
+                        {_text_to_day_sql("registration_expiry")},
+                        {_text_to_day_sql("insurance_expiry")}, updated_at
+                 FROM vehicles""")
+    rejected = (_migrate_text_dates(conn, "registration_expiry")
+                + _migrate_text_dates(conn, "insurance_expiry"))
+    if rejected:
+        conn.execute("""CREATE TABLE IF NOT EXISTS rejected_expiry_dates (
+            vehicle_id INTEGER NOT NULL,
+            plate_number TEXT,
+            field TEXT NOT NULL,
+            value TEXT NOT NULL
+        )""")
+        conn.executemany("INSERT INTO rejected_expiry_dates VALUES (?, ?, ?, ?)",
+                         rejected)
+        logger.warning("%d expiry dates could not be read and were stored "
+                       "as NULL; the original text is in "
+                       "rejected_expiry_dates", len(rejected))
+    conn.execute("DROP TABLE vehicles")
+    conn.execute("ALTER TABLE vehicles_new RENAME TO vehicles")
+    _create_vehicle_indexes(conn)
+    _create_search_index(conn)
+
+
+def _create_summary_triggers(conn, columns="earliest_expiry"):
+    # Keeps expiry_summary (vehicle counts per earliest_expiry day) in step
+    # with vehicles. Vehicles without any expiry date are counted under
+    # _NO_EXPIRY_DAY, outside the valid day range. columns are the ones
+    # whose updates can move earliest_expiry.
+    day = f"coalesce(new.earliest_expiry, {_NO_EXPIRY_DAY})"
+    old_day = f"coalesce(old.earliest_expiry, {_NO_EXPIRY_DAY})"
+    add = f"""INSERT INTO expiry_summary (expiry_day, vehicles)
+              VALUES ({day}, 1)
+              ON CONFLICT (expiry_day) DO UPDATE SET vehicles = vehicles + 1;"""
+    remove = f"""UPDATE expiry_summary SET vehicles = vehicles - 1
+                 WHERE expiry_day = {old_day};"""
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS expiry_summary_insert
+                 AFTER INSERT ON vehicles BEGIN {add} END""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS expiry_summary_delete
+                 AFTER DELETE ON vehicles BEGIN {remove} END""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS expiry_summary_update
+                 AFTER UPDATE OF {columns} ON vehicles
+                 WHEN old.earliest_expiry IS NOT new.earliest_expiry
+                 BEGIN {remove} {add} END""")
+
+
+def _migrate_expiry_summary(conn):
+    conn.execute("""CREATE TABLE expiry_summary (
+        expiry_day INTEGER PRIMARY KEY,
+        vehicles INTEGER NOT NULL
+    ) WITHOUT ROWID""")
+    conn.execute(f"""INSERT INTO expiry_summary (expiry_day, vehicles)
+                 SELECT coalesce(earliest_expiry, {_NO_EXPIRY_DAY}), count(*)
+                 FROM vehicles GROUP BY 1""")
+    _create_summary_triggers(conn, "registration_expiry, insurance_expiry")
+
+
+def _create_document_triggers(conn):
+    for doc_type, column in _VEHICLE_DOCUMENT_COLUMNS.items():
+        insert = f"""INSERT INTO documents (vehicle_id, doc_type, expiry_day)
+                     SELECT new.id, '{doc_type}', new.{column}
+                     WHERE new.{column} IS NOT NULL;"""
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS documents_{doc_type}_insert
+                     AFTER INSERT ON vehicles BEGIN {insert} END""")
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS documents_{doc_type}_update
+                     AFTER UPDATE OF {column} ON vehicles
+                     WHEN old.{column} IS NOT new.{column}
+                     BEGIN
+                         DELETE FROM documents
+                         WHERE vehicle_id = new.id AND doc_type = '{doc_type}';
+                         {insert}
+                     END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS documents_vehicle_delete
+                 AFTER DELETE ON vehicles BEGIN
+                     DELETE FROM documents WHERE vehicle_id = old.id;
+                 END""")
+
+
+def _migrate_documents(conn):
+    conn.execute(f"""CREATE TABLE documents (
+        vehicle_id INTEGER NOT NULL,
+        doc_type TEXT NOT NULL,
+        expiry_day INTEGER NOT NULL {_day_check("expiry_day")},
+        PRIMARY KEY (vehicle_id, doc_type)
+    ) WITHOUT ROWID""")
+    conn.execute("""CREATE INDEX idx_documents_expiry
+                 ON documents (expiry_day, doc_type)""")
+    for doc_type, column in _VEHICLE_DOCUMENT_COLUMNS.items():
+        conn.execute(f"""INSERT INTO documents (vehicle_id, doc_type, expiry_day)
+                     SELECT id, ?, {column} FROM vehicles
+                     WHERE {column} IS NOT NULL""", (doc_type,))
+    _create_document_triggers(conn)
+
+
+def _create_version_triggers(conn):
+    # Every change to a vehicle (or to one of its extra documents) takes
+    # the next sync_state version as its row_version and refreshes
+    # updated_at; deleted or renamed plates leave a tombstone.
+    bump = "UPDATE sync_state SET version = version + 1;"
+
+    def stamp(vehicle_id):
+        return f"""UPDATE vehicles
+                   SET row_version = (SELECT version FROM sync_state),
+                       updated_at = {_NOW_SQL}
+                   WHERE id = {vehicle_id};"""
+
+    def tombstone(condition="1"):
+        return f"""INSERT OR REPLACE INTO vehicle_tombstones
+                   (plate_number, row_version, deleted_at)
+                   SELECT old.plate_number, version, {_NOW_SQL}
+                   FROM sync_state WHERE {condition};"""
+
+    revive = """DELETE FROM vehicle_tombstones
+                WHERE plate_number = new.plate_number;"""
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS vehicles_version_insert
+                 AFTER INSERT ON vehicles
+                 BEGIN {bump} {stamp("new.id")} {revive} END""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS vehicles_version_update
+                 AFTER UPDATE OF name, plate_number, registration_expiry,
+                                 insurance_expiry ON vehicles
+                 WHEN old.name IS NOT new.name
+                      OR old.plate_number IS NOT new.plate_number
+                      OR old.registration_expiry IS NOT new.registration_expiry
+                      OR old.insurance_expiry IS NOT new.insurance_expiry
+                 BEGIN
+                     {bump} {stamp("new.id")}
+                     {tombstone("old.plate_number IS NOT new.plate_number")}
+                     {revive}
+                 END""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS vehicles_version_delete
+                 AFTER DELETE ON vehicles BEGIN {bump} {tombstone()} END""")
+    core = ", ".join(f"'{doc_type}'" for doc_type in _VEHICLE_DOCUMENT_COLUMNS)
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS documents_version_insert
+                 AFTER INSERT ON documents
+                 WHEN new.doc_type NOT IN ({core})
+                 BEGIN {bump} {stamp("new.vehicle_id")} END""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS documents_version_update
+                 AFTER UPDATE ON documents
+                 WHEN new.doc_type NOT IN ({core})
+                      AND old.expiry_day IS NOT new.expiry_day
+                 BEGIN {bump} {stamp("new.vehicle_id")} END""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS documents_version_delete
+                 AFTER DELETE ON documents
+                 WHEN old.doc_type NOT IN ({core})
+                 BEGIN {bump} {stamp("old.vehicle_id")} END""")
+
+
+def _migrate_row_versions(conn):
+    conn.execute("""ALTER TABLE vehicles
+                 ADD COLUMN row_version INTEGER NOT NULL DEFAULT 0""")
+    conn.execute("UPDATE vehicles SET row_version = id")
+    conn.execute("""CREATE INDEX idx_vehicles_row_version
+                 ON vehicles (row_version)""")
+    conn.execute("""CREATE TABLE sync_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )""")
+    conn.execute("""INSERT INTO sync_state (id, version)
+                 SELECT 1, coalesce(max(id), 0) FROM vehicles""")
+    conn.execute("""CREATE TABLE vehicle_tombstones (
+        plate_number TEXT PRIMARY KEY,
+        row_version INTEGER NOT NULL,
+        deleted_at TEXT NOT NULL
+    ) WITHOUT ROWID""")
+    conn.execute("""CREATE INDEX idx_vehicle_tombstones_row_version
+                 ON vehicle_tombstones (row_version)""")
+    conn.execute("ALTER TABLE backups ADD COLUMN row_version INTEGER")
+    _create_version_triggers(conn)
+
+
+def _migrate_archive(conn):
+    # Cold storage for deleted vehicles and vehicles whose documents all
+    # expired long ago; documents holds their extra documents as JSON.
+    conn.execute(f"""CREATE TABLE vehicles_archive (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        vehicle_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        plate_number TEXT NOT NULL,
+        registration_expiry INTEGER {_day_check("registration_expiry")},
+        insurance_expiry INTEGER {_day_check("insurance_expiry")},
+        documents TEXT,
+        updated_at TEXT,
+        archived_at TEXT NOT NULL,
+        reason TEXT NOT NULL
+    )""")
+    conn.execute("""CREATE INDEX idx_vehicles_archive_plate_number
+                 ON vehicles_archive (plate_number)""")
+
 
+def _migrate_scan_versions(conn):
+    # Scans remember the sync version they started from, so vehicles
+    # written since are found by row_version rather than by timestamp.
+    conn.execute("ALTER TABLE scan_runs ADD COLUMN row_version INTEGER")
 
+
+def _create_earliest_expiry_triggers(conn):
+    # earliest_expiry is the earliest expiry_day over all of a vehicle's
+    # documents, so every document type counts towards its status.
+    def refresh(vehicle_id):
+        return f"""UPDATE vehicles
+                   SET earliest_expiry = (SELECT min(expiry_day)
+                                          FROM documents
+                                          WHERE vehicle_id = {vehicle_id})
+                   WHERE id = {vehicle_id};"""
+
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS earliest_expiry_insert
+                 AFTER INSERT ON documents
+                 BEGIN {refresh("new.vehicle_id")} END""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS earliest_expiry_update
+                 AFTER UPDATE OF expiry_day ON documents
+                 WHEN old.expiry_day IS NOT new.expiry_day
+                 BEGIN {refresh("new.vehicle_id")} END""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS earliest_expiry_delete
+                 AFTER DELETE ON documents
+                 BEGIN {refresh("old.vehicle_id")} END""")
+
+
+def _migrate_document_expiry(conn):
+    # earliest_expiry stops being generated from the registration and
+    # insurance columns and is kept from documents instead.
+    for event in ("insert", "delete", "update"):
+        conn.execute(f"DROP TRIGGER expiry_summary_{event}")
+    conn.execute("DROP INDEX idx_vehicles_earliest_expiry")
+    conn.execute("ALTER TABLE vehicles DROP COLUMN earliest_expiry")
+    conn.execute("ALTER TABLE vehicles ADD COLUMN earliest_expiry INTEGER")
+    conn.execute("""UPDATE vehicles
+                 SET earliest_expiry = (SELECT min(expiry_day) FROM documents
+                                        WHERE vehicle_id = vehicles.id)""")
+    _create_vehicle_indexes(conn)
+    conn.execute("DELETE FROM expiry_summary")
+    conn.execute(f"""INSERT INTO expiry_summary (expiry_day, vehicles)
+                 SELECT coalesce(earliest_expiry, {_NO_EXPIRY_DAY}), count(*)
+                 FROM vehicles GROUP BY 1""")
+    _create_summary_triggers(conn)
+    _create_earliest_expiry_triggers(conn)
+
+
+def _migrate_archive_versions(conn):
+    # Archived vehicles take a sync version like live ones, so incremental
+    # backups pick them up by version rather than by archived_at. Vehicles
+    # archived before this migration count as changed now.
+    conn.execute("""ALTER TABLE vehicles_archive
+                 ADD COLUMN row_version INTEGER NOT NULL DEFAULT 0""")
+    conn.execute("""UPDATE vehicles_archive
+                 SET row_version = (SELECT version FROM sync_state)""")
+    conn.execute("""CREATE INDEX idx_vehicles_archive_row_version
+                 ON vehicles_archive (row_version)""")
+
+
+MIGRATIONS = [_migrate_baseline, _migrate_epoch_days, _migrate_expiry_summary,
+              _migrate_documents, _migrate_row_versions, _migrate_archive,
+              _migrate_scan_versions, _migrate_document_expiry,
+              _migrate_archive_versions]
+
+
+@instrument
+def schema_version():
+    with get_conn() as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+@instrument
 def initialize():
+    # Called on every Streamlit rerun; only the first call per process and
+    # database file touches the database.
+    path = str(DB_FILE)
+    if path in _initialized:
+        return
     with get_conn() as conn:
-        conn.execute("""CREATE TABLE IF NOT EXISTS vehicles (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            plate_number TEXT UNIQUE,
-            registration_expiry TEXT,
-            insurance_expiry TEXT
-        )""")
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= len(MIGRATIONS):
+            _initialized.add(path)
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        # Re-read under the write lock in case another process migrated.
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number in range(version, len(MIGRATIONS)):
+            MIGRATIONS[number](conn)
+            conn.execute(f"PRAGMA user_version = {number + 1}")
+    _initialized.add(path)
+    invalidate_cache()
+
+
+def parse_dates(values):
+    # ISO-8601 first, then the day-first forms spreadsheets commonly hold;
+    # returns YYYY-MM-DD text, or None where no format matches.
+    import pandas as pd
+    raw = pd.Series(values, dtype=object)
+    parsed = pd.to_datetime(raw, errors="coerce", format=DATE_FORMATS[0])
+    for fmt in DATE_FORMATS[1:]:
+        missing = parsed.isna() & raw.notna()
+        if not missing.any():
+            break
+        parsed[missing] = pd.to_datetime(raw[missing], errors="coerce",
+                                         format=fmt)
+    formatted = parsed.dt.strftime("%Y-%m-%d")
+    return [None if missing else text
+            for text, missing in zip(formatted, parsed.isna())]
+
+
+# How pandas and str() spell a missing cell; legacy backups stored these.
+_MISSING_TEXT = {"nan", "NaN", "NaT", "None"}
 
 
-def add_vehicle(name, plate, reg_expiry, ins_expiry):
+def _to_day(value):
+    if value is None or value != value:
+        return None
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    if isinstance(value, datetime.date):
+        return value.toordinal() - _EPOCH_ORDINAL
+    text = str(value).strip()
+    if not text or text in _MISSING_TEXT:
+        return None
+    try:
+        return datetime.date.fromisoformat(text[:10]).toordinal() - _EPOCH_ORDINAL
+    except ValueError:
+        raise ValueError(f"تاريخ غير صالح: {text}")
+
+
+def _from_day(day):
+    if day is None:
+        return None
+    return datetime.date.fromordinal(day + _EPOCH_ORDINAL)
+
+
+def _vehicle_rows(rows):
+    return [(name, plate, _from_day(reg), _from_day(ins))
+            for name, plate, reg, ins in rows]
+
+
+def _normalize_search_text(text):
+    return str(text).translate(_SEARCH_TABLE).strip()
+
+
+def _normalize_plate(plate):
+    plate = _normalize_search_text(plate)
+    for separator in _PLATE_SEPARATORS:
+        plate = plate.replace(separator, "")
+    return plate
+
+
+def _fts_phrase(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _escape_like(term):
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _sql_normalize(expr, plate=False):
+    for source, target in _SEARCH_NORMALIZATION.items():
+        expr = f"replace({expr}, '{source}', '{target}')"
+    if plate:
+        for separator in _PLATE_SEPARATORS:
+            expr = f"replace({expr}, '{separator}', '')"
+    return expr
+
+
+def _create_search_index(conn):
+    exists = conn.execute("""SELECT 1 FROM sqlite_master
+                          WHERE name = 'vehicles_fts'""").fetchone()
+    if not exists:
+        conn.execute("""CREATE VIRTUAL TABLE vehicles_fts
+                     USING fts5(name, plate, tokenize='trigram')""")
+        conn.execute(f"""INSERT INTO vehicles_fts (rowid, name, plate)
+                     SELECT id, {_sql_normalize("name")},
+                            {_sql_normalize("plate_number", plate=True)}
+                     FROM vehicles""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS vehicles_fts_insert
+                 AFTER INSERT ON vehicles BEGIN
+                     INSERT INTO vehicles_fts (rowid, name, plate)
+                     VALUES (new.id, {_sql_normalize("new.name")},
+                             {_sql_normalize("new.plate_number", plate=True)});
+                 END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS vehicles_fts_delete
+                 AFTER DELETE ON vehicles BEGIN
+                     DELETE FROM vehicles_fts WHERE rowid = old.id;
+                 END""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS vehicles_fts_update
+                 AFTER UPDATE OF name, plate_number ON vehicles
+                 WHEN old.name IS NOT new.name
+                      OR old.plate_number IS NOT new.plate_number BEGIN
+                     UPDATE vehicles_fts
+                     SET name = {_sql_normalize("new.name")},
+                         plate = {_sql_normalize("new.plate_number", plate=True)}
+                     WHERE rowid = new.id;
+                 END""")
+
+
+def _insert_vehicle(conn, name, plate, reg_day, ins_day):
+    conn.execute("""INSERT INTO vehicles
+                 (name, plate_number, registration_expiry, insurance_expiry)
+                 VALUES (?, ?, ?, ?)""",
+                 (name, plate, reg_day, ins_day))
+    return True
+
+
+@instrument
+def add_vehicle(name, plate, reg_expiry, ins_expiry, wait=True):
+    # wait=False returns a Future instead of blocking until the commit.
     try:
         if not name or not plate:
             raise ValueError("اسم السيارة ورقم اللوحة مطلوبان")
-        with get_conn() as conn:
-            conn.execute("""INSERT INTO vehicles
-                         (name, plate_number, registration_expiry, insurance_expiry)
-                         VALUES (?, ?, ?, ?)""",
-                         (name, plate, reg_expiry, ins_expiry))
-            return True
-    except sqlite3.IntegrityError:
-        raise ValueError("رقم اللوحة موجود مسبقاً")
+        return _write(_insert_vehicle, (name, plate, _to_day(reg_expiry),
+                                        _to_day(ins_expiry)), wait)
+    except DatabaseError:
+        raise
     except Exception as e:
         raise ValueError(f"خطأ في إضافة السيارة: {str(e)}")
 
 
-def get_all_vehicles():
+def _clean_value(value):
+    if value is None or value != value:
+        return None
+    value = str(value).strip()
+    if value in _MISSING_TEXT:
+        return None
+    return value or None
+
+
+def _existing_plates(conn, plates):
+    existing = set()
+    plates = list(plates)
+    for start in range(0, len(plates), 500):
+        part = plates[start:start + 500]
+        marks = ", ".join("?" * len(part))
+        existing.update(row[0] for row in conn.execute(
+            f"SELECT plate_number FROM vehicles WHERE plate_number IN ({marks})",
+            part))
+    return existing
+
+
+def _write_vehicle_batch(conn, batch, on_conflict, seen, report):
+    existing = _existing_plates(conn, {row[1] for _, row in batch}) | seen
+    inserts = []
+    updates = []
+    documents = []
+    for index, row in batch:
+        if row[1] in existing:
+            if on_conflict == "fail":
+                raise ValueError(f"الصف {index + 1}: رقم اللوحة موجود مسبقاً")
+            if on_conflict == "skip":
+                report["skipped"] += 1
+                report["errors"].append({"index": index, "plate": row[1],
+                                         "status": "skipped",
+                                         "error": "رقم اللوحة موجود مسبقاً"})
+                continue
+            updates.append((row[0], row[2], row[3], row[1]))
+        else:
+            inserts.append(row[:4])
+        documents.extend((row[1], doc_type, day) for doc_type, day in row[4])
+        existing.add(row[1])
+        seen.add(row[1])
+    if inserts:
+        conn.executemany("""INSERT INTO vehicles
+                         (name, plate_number, registration_expiry, insurance_expiry)
+                         VALUES (?, ?, ?, ?)""", inserts)
+    if updates:
+        cursor = conn.executemany("""UPDATE vehicles
+                         SET name = ?1, registration_expiry = ?2,
+                             insurance_expiry = ?3
+                         WHERE plate_number = ?4
+                           AND (name IS NOT ?1 OR registration_expiry IS NOT ?2
+                                OR insurance_expiry IS NOT ?3)""", updates)
+        # The WHERE clause skips unchanged rows, so only the rows actually
+        # written count as updated.
+        report["updated"] += cursor.rowcount
+    if documents:
+        conn.executemany("""INSERT INTO documents (vehicle_id, doc_type, expiry_day)
+                         SELECT id, ?2, ?3 FROM vehicles WHERE plate_number = ?1
+                         ON CONFLICT (vehicle_id, doc_type)
+                         DO UPDATE SET expiry_day = excluded.expiry_day""",
+                         documents)
+    report["inserted"] += len(inserts)
+
+
+def _write_vehicles(conn, rows, on_conflict, chunk_size, batch_size):
+    report = {"inserted": 0, "updated": 0, "skipped": 0, "failed": 0,
+              "errors": []}
+    seen = set()
+    batch = []
+    pending = 0
+    for index, row in enumerate(rows):
+        row = tuple(row)
+        # Backups carry other document types as an optional fifth element.
+        extra = row[4] if len(row) > 4 and isinstance(row[4], dict) else {}
+        row = tuple(_clean_value(value) for value in row[:4])
+        if len(row) < 4:
+            error = "عدد الأعمدة غير كافٍ"
+        elif not row[0] or not row[1]:
+            error = "اسم السيارة ورقم اللوحة مطلوبان"
+        elif any(doc_type not in DOCUMENT_TYPES
+                 or doc_type in _VEHICLE_DOCUMENT_COLUMNS for doc_type in extra):
+            error = "نوع وثيقة غير معروف"
+        else:
+            try:
+                documents = [(doc_type, _to_day(_clean_value(value)))
+                             for doc_type, value in extra.items()]
+                row = (row[0], row[1], _to_day(row[2]), _to_day(row[3]),
+                       [document for document in documents
+                        if document[1] is not None])
+                error = None
+            except ValueError:
+                error = "تاريخ انتهاء غير صالح"
+        if error:
+            report["failed"] += 1
+            report["errors"].append({"index": index,
+                                     "plate": row[1] if len(row) > 1 else None,
+                                     "status": "failed", "error": error})
+            continue
+        batch.append((index, row))
+        if len(batch) >= batch_size:
+            _write_vehicle_batch(conn, batch, on_conflict, seen, report)
+            pending += len(batch)
+            batch = []
+            if chunk_size and pending >= chunk_size:
+                conn.commit()
+                pending = 0
+    if batch:
+        _write_vehicle_batch(conn, batch, on_conflict, seen, report)
+    report["errors"].sort(key=lambda error: error["index"])
+    return report
+
+
+@instrument
+def bulk_add_vehicles(rows, on_conflict="skip", chunk_size=None,
+                      batch_size=1000):
+    if on_conflict not in ("skip", "update", "fail"):
+        raise ValueError(f"سياسة تعارض غير معروفة: {on_conflict}")
     try:
+        return _write(_write_vehicles,
+                      (rows, on_conflict, chunk_size, batch_size), True,
+                      exclusive=True)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"خطأ في استيراد السيارات: {str(e)}")
+
+
+@instrument
+@_cached_query
+def get_all_vehicles(include_archive=False):
+    # The archive is only read on request; it may list a plate that was
+    # deleted and later added again.
+    try:
+        columns = "name, plate_number, registration_expiry, insurance_expiry"
+        query = f"SELECT {columns} FROM vehicles"
+        if include_archive:
+            query += f" UNION ALL SELECT {columns} FROM vehicles_archive"
         with get_conn() as conn:
-            return conn.execute("""SELECT name, plate_number,
-                                 registration_expiry, insurance_expiry
-                                 FROM vehicles""").fetchall()
+            rows = conn.execute(query).fetchall()
+        return _vehicle_rows(rows)
+    except Exception as e:
+        raise ValueError(f"خطأ في جلب البيانات: {str(e)}")
+
+
+@instrument
+@_cached_query
+def get_vehicle(plate):
+    # Point lookup on the unique plate_number index; None when missing.
+    try:
+        with get_conn() as conn:
+            rows = conn.execute("""SELECT name, plate_number,
+                                registration_expiry, insurance_expiry
+                                FROM vehicles WHERE plate_number = ?""",
+                                (plate,)).fetchall()
+        return _vehicle_rows(rows)[0] if rows else None
     except Exception as e:
         raise ValueError(f"خطأ في جلب البيانات: {str(e)}")
 
 
-def update_vehicle(name, plate, reg_expiry, ins_expiry):
+def _update_vehicle(conn, name, plate, reg_day, ins_day):
+    cursor = conn.execute("""UPDATE vehicles
+                 SET name = ?, registration_expiry = ?, insurance_expiry = ?
+                 WHERE plate_number = ?""",
+                 (name, reg_day, ins_day, plate))
+    if cursor.rowcount == 0:
+        raise VehicleNotFoundError()
+    return True
+
+
+@instrument
+def update_vehicle(name, plate, reg_expiry, ins_expiry, wait=True):
     try:
         if not name or not plate:
             raise ValueError("اسم السيارة ورقم اللوحة مطلوبان")
-        with get_conn() as conn:
-            cursor = conn.execute("""UPDATE vehicles
-                         SET name = ?, registration_expiry = ?, insurance_expiry = ?
-                         WHERE plate_number = ?""",
-                         (name, reg_expiry, ins_expiry, plate))
-            if cursor.rowcount == 0:
-                raise ValueError("السيارة غير موجودة")
-            return True
+        return _write(_update_vehicle, (name, plate, _to_day(reg_expiry),
+                                        _to_day(ins_expiry)), wait)
+    except DatabaseError:
+        raise
     except Exception as e:
         raise ValueError(f"خطأ في تحديث السيارة: {str(e)}")
 
 
-def delete_vehicle(plate):
+def _archive_vehicles_where(conn, where, params, reason):
+    # Copies the matching vehicles and their extra documents into
+    # vehicles_archive, then removes them from the live table. The archived
+    # rows take the next sync version, which the delete below claims.
+    core = ", ".join(f"'{doc_type}'" for doc_type in _VEHICLE_DOCUMENT_COLUMNS)
+    conn.execute(f"""INSERT INTO vehicles_archive
+                 (vehicle_id, name, plate_number, registration_expiry,
+                  insurance_expiry, documents, updated_at, archived_at, reason,
+                  row_version)
+                 SELECT id, name, plate_number, registration_expiry,
+                        insurance_expiry,
+                        (SELECT nullif(json_group_object(doc_type, expiry_day),
+                                       '{{}}')
+                         FROM documents WHERE vehicle_id = vehicles.id
+                         AND doc_type NOT IN ({core})),
+                        updated_at, {_NOW_SQL}, ?,
+                        (SELECT version + 1 FROM sync_state)
+                 FROM vehicles WHERE {where}""", [reason] + params)
+    return conn.execute(f"DELETE FROM vehicles WHERE {where}", params).rowcount
+
+
+def _delete_vehicle(conn, plate, archive):
+    if archive:
+        deleted = _archive_vehicles_where(conn, "plate_number = ?", [plate],
+                                          "deleted")
+    else:
+        deleted = conn.execute("DELETE FROM vehicles WHERE plate_number = ?",
+                               (plate,)).rowcount
+    if deleted == 0:
+        raise VehicleNotFoundError()
+    return True
+
+
+@instrument
+def delete_vehicle(plate, wait=True, archive=False):
+    # archive=True keeps the vehicle in vehicles_archive instead of
+    # discarding it.
     try:
-        with get_conn() as conn:
-            cursor = conn.execute("DELETE FROM vehicles WHERE plate_number = ?",
-                                 (plate,))
-            if cursor.rowcount == 0:
-                raise ValueError("السيارة غير موجودة")
-            return True
+        return _write(_delete_vehicle, (plate, archive), wait)
+    except DatabaseError:
+        raise
     except Exception as e:
         raise ValueError(f"خطأ في حذف السيارة: {str(e)}")
 
 
-def search_vehicles(search_term):
+@instrument
+def archive_vehicles(older_than_days=ARCHIVE_AFTER_DAYS, today=None):
+    # Moves vehicles whose documents all expired more than older_than_days
+    # ago out of the live table; vehicles without any document stay.
+    # Returns the number of vehicles archived.
+    try:
+        if not isinstance(older_than_days, int) or older_than_days < 0:
+            raise ValueError(f"عدد أيام غير صالح: {older_than_days}")
+        cutoff = _to_day(today or datetime.date.today()) - older_than_days
+        return _write(_archive_vehicles_where, (
+            """earliest_expiry < ? AND NOT EXISTS (
+                   SELECT 1 FROM documents
+                   WHERE vehicle_id = vehicles.id AND expiry_day >= ?)""",
+            [cutoff, cutoff], "expired"), True, exclusive=True)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"خطأ في أرشفة السيارات: {str(e)}")
+
+
+@instrument
+@_cached_query
+def get_archived_vehicles(limit=PAGE_SIZE):
+    # Most recently archived first.
+    try:
+        with get_conn() as conn:
+            rows = conn.execute("""SELECT name, plate_number,
+                                registration_expiry, insurance_expiry
+                                FROM vehicles_archive
+                                ORDER BY id DESC LIMIT ?""", (limit,)).fetchall()
+        return _vehicle_rows(rows)
+    except Exception as e:
+        raise ValueError(f"خطأ في جلب الأرشيف: {str(e)}")
+
+
+@instrument
+@_cached_query
+def count_archived_vehicles():
+    with get_conn() as conn:
+        return conn.execute("SELECT count(*) FROM vehicles_archive").fetchone()[0]
+
+
+def iter_vehicles(batch_size=5000):
     try:
         with get_conn() as conn:
-            return conn.execute(
-                """SELECT name, plate_number, registration_expiry, insurance_expiry
-                   FROM vehicles WHERE name LIKE ? OR plate_number LIKE ?""",
-                (f"%{search_term}%", f"%{search_term}%")
-            ).fetchall()
+            cursor = conn.execute("""SELECT name, plate_number,
+                                  registration_expiry, insurance_expiry
+                                  FROM vehicles ORDER BY id""")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield _vehicle_rows(rows)
+    except Exception as e:
+        raise ValueError(f"خطأ في جلب البيانات: {str(e)}")
+
+
+@instrument
+@_cached_query
+def search_vehicles(search_term, limit=SEARCH_LIMIT):
+    try:
+        name_term = _normalize_search_text(search_term)
+        plate_term = _normalize_plate(search_term)
+        if not name_term:
+            return []
+        # Trigram MATCH needs at least three characters, so each column
+        # uses its own quoted phrase (spaces stay literal) or, for shorter
+        # text, a LIKE scan.
+        phrases = []
+        likes = []
+        for column, term in (("name", name_term), ("plate", plate_term)):
+            if len(term) >= 3:
+                phrases.append(f"{column} : {_fts_phrase(term)}")
+            elif term:
+                likes.append((column, term))
+        with get_conn() as conn:
+            if not likes:
+                return _vehicle_rows(conn.execute(
+                    """SELECT v.name, v.plate_number, v.registration_expiry,
+                              v.insurance_expiry
+                       FROM vehicles_fts f JOIN vehicles v ON v.id = f.rowid
+                       WHERE vehicles_fts MATCH ?
+                       ORDER BY f.rank LIMIT ?""",
+                    (" OR ".join(phrases), limit)
+                ))
+            conditions = [f"f.{column} LIKE ? ESCAPE '\\'"
+                          for column, _ in likes]
+            params = [f"%{_escape_like(term)}%" for _, term in likes]
+            if phrases:
+                conditions.append("""f.rowid IN (SELECT rowid FROM vehicles_fts
+                                      WHERE vehicles_fts MATCH ?)""")
+                params.append(" OR ".join(phrases))
+            return _vehicle_rows(conn.execute(
+                f"""SELECT v.name, v.plate_number, v.registration_expiry,
+                           v.insurance_expiry
+                    FROM vehicles_fts f JOIN vehicles v ON v.id = f.rowid
+                    WHERE {" OR ".join(conditions)}
+                    LIMIT ?""",
+                params + [limit]
+            ))
     except Exception as e:
         raise ValueError(f"خطأ في البحث: {str(e)}")
 
 
+def _status_filter(status):
+    today = _to_day(datetime.date.today())
+    future_day = today + NEAR_EXPIRY_DAYS
+    if status == "expired":
+        return "earliest_expiry < ?", [today]
+    if status == "near_expiry":
+        return "earliest_expiry BETWEEN ? AND ?", [today, future_day]
+    if status == "valid":
+        return "earliest_expiry > ?", [future_day]
+    return "1", []
+
+
+@instrument
+@_cached_query
+def get_status_summary(today=None):
+    # Reads the trigger-maintained per-day counts, so the cost depends on
+    # the number of distinct expiry days rather than the fleet size.
+    today = _to_day(today or datetime.date.today())
+    try:
+        with get_conn() as conn:
+            total, expired, near_expiry, valid = conn.execute(
+                """SELECT coalesce(sum(vehicles), 0),
+                          coalesce(sum(vehicles) FILTER (
+                              WHERE expiry_day < ?1), 0),
+                          coalesce(sum(vehicles) FILTER (
+                              WHERE expiry_day BETWEEN ?1 AND ?2), 0),
+                          coalesce(sum(vehicles) FILTER (
+                              WHERE expiry_day > ?2 AND expiry_day <= ?3), 0)
+                   FROM expiry_summary""",
+                (today, today + NEAR_EXPIRY_DAYS, MAX_DAY)
+            ).fetchone()
+        return {"total": total, "expired": expired,
+                "near_expiry": near_expiry, "valid": valid}
+    except Exception as e:
+        raise ValueError(f"خطأ في جلب البيانات: {str(e)}")
+
+
+@instrument
+@_cached_query
 def get_vehicles_by_status(status):
     try:
-        today = datetime.date.today().strftime('%Y-%m-%d')
+        if status not in ("expired", "near_expiry", "valid"):
+            return get_all_vehicles()
+        where, params = _status_filter(status)
         with get_conn() as conn:
-            if status == "expired":
-                return conn.execute("""SELECT name, plate_number,
-                                     registration_expiry, insurance_expiry
-                                     FROM vehicles
-                                     WHERE registration_expiry < ? OR
-                                     insurance_expiry < ?""",
-                                     (today, today)).fetchall()
-            elif status == "near_expiry":
-                future_date = (datetime.date.today() +
-                               datetime.timedelta(days=30)).strftime('%Y-%m-%d')
-                return conn.execute("""SELECT name, plate_number,
-                                     registration_expiry, insurance_expiry
-                                     FROM vehicles
-                                     WHERE (registration_expiry BETWEEN ? AND ?)
-                                     OR (insurance_expiry BETWEEN ? AND ?)""",
-                                     (today, future_date, today,
-                                      future_date)).fetchall()
-            else:
-                return get_all_vehicles()
+            return _vehicle_rows(conn.execute(
+                f"""SELECT name, plate_number,
+                    registration_expiry, insurance_expiry
+                    FROM vehicles WHERE {where}
+                    ORDER BY earliest_expiry""", params))
     except Exception as e:
         raise ValueError(f"خطأ في فلترة السيارات: {str(e)}")
 
 
-def backup_data():
+@instrument
+@_cached_query
+def list_vehicles(after_key=None, limit=PAGE_SIZE, order_by="name",
+                  status=None):
+    try:
+        if order_by not in LIST_ORDER_COLUMNS:
+            raise ValueError(f"عمود ترتيب غير معروف: {order_by}")
+        where, params = _status_filter(status)
+        index = ""
+        if status in ("expired", "near_expiry", "valid"):
+            # Walking the order index reads about total / matching rows per
+            # row returned, so a selective status is read by expiry and
+            # sorted instead.
+            summary = get_status_summary()
+            if summary[status] ** 2 < limit * summary["total"]:
+                index = "INDEXED BY idx_vehicles_earliest_expiry"
+        if after_key is not None:
+            value, last_id = after_key
+            if value is None:
+                where += f" AND (({order_by} IS NULL AND id > ?) OR {order_by} IS NOT NULL)"
+                params.append(last_id)
+            else:
+                where += f" AND ({order_by}, id) > (?, ?)"
+                params.extend([value, last_id])
+        with get_conn() as conn:
+            rows = conn.execute(f"""SELECT id, {order_by}, name, plate_number,
+                                 registration_expiry, insurance_expiry
+                                 FROM vehicles {index} WHERE {where}
+                                 ORDER BY {order_by}, id LIMIT ?""",
+                                params + [limit]).fetchall()
+        next_key = (rows[-1][1], rows[-1][0]) if len(rows) == limit else None
+        return _vehicle_rows(row[2:] for row in rows), next_key
+    except Exception as e:
+        raise ValueError(f"خطأ في جلب البيانات: {str(e)}")
+
+
+@instrument
+@_cached_query
+def count_vehicles(status=None):
+    summary = get_status_summary()
+    if status in ("expired", "near_expiry", "valid"):
+        return summary[status]
+    return summary["total"]
+
+
+def _read_changes(since_version):
+    with get_conn() as conn:
+        conn.execute("BEGIN")
+        version = conn.execute("SELECT version FROM sync_state").fetchone()[0]
+        changed = conn.execute("""SELECT name, plate_number,
+                               registration_expiry, insurance_expiry,
+                               earliest_expiry
+                               FROM vehicles WHERE row_version > ?
+                               ORDER BY row_version""",
+                               (since_version,)).fetchall()
+        deleted = [plate for plate, in conn.execute(
+            """SELECT plate_number FROM vehicle_tombstones
+               WHERE row_version > ? ORDER BY row_version""",
+            (since_version,))]
+    return changed, deleted, version
+
+
+@instrument
+@_cached_query
+def get_changes(since_version=0):
+    # Vehicles inserted or changed after since_version, plates deleted
+    # since then, and the version to pass on the next call.
+    try:
+        changed, deleted, version = _read_changes(since_version)
+        return _vehicle_rows(row[:4] for row in changed), deleted, version
+    except Exception as e:
+        raise ValueError(f"خطأ في جلب التغييرات: {str(e)}")
+
+
+@instrument
+def read_changes(since_version=0):
+    # get_changes() without the query cache, with expiry dates left as day
+    # numbers and earliest_expiry (over every document) as a fifth column,
+    # for fleet.FleetSnapshot.
+    try:
+        return _read_changes(since_version)
+    except Exception as e:
+        raise ValueError(f"خطأ في جلب التغييرات: {str(e)}")
+
+
+@instrument
+def get_last_scan():
+    try:
+        with get_conn() as conn:
+            # Scans recorded before versions were kept count as version 0,
+            # so the next scan looks at every vehicle once.
+            return conn.execute("""SELECT scan_date, coalesce(row_version, 0)
+                                FROM scan_runs
+                                ORDER BY id DESC LIMIT 1""").fetchone()
+    except Exception as e:
+        raise ValueError(f"خطأ في جلب حالة الفحص: {str(e)}")
+
+
+def _document_rows(rows):
+    return [(name, plate, doc_type, _from_day(day))
+            for name, plate, doc_type, day in rows]
+
+
+def _doc_type_filter(doc_types):
+    if doc_types is None:
+        return "", []
+    doc_types = list(doc_types)
+    unknown = [doc_type for doc_type in doc_types
+               if doc_type not in DOCUMENT_TYPES]
+    if unknown:
+        raise ValueError(f"نوع وثيقة غير معروف: {unknown[0]}")
+    return (f" AND d.doc_type IN ({', '.join('?' * len(doc_types))})",
+            doc_types)
+
+
+@instrument
+@_cached_query
+def get_expiring_documents(start=None, end=None, doc_types=None):
+    # (name, plate, doc_type, expiry) for every document expiring in
+    # [start, end], in expiry order: one range scan on idx_documents_expiry
+    # whatever the number of document types.
+    try:
+        low = MIN_DAY if start is None else _to_day(start)
+        high = MAX_DAY if end is None else _to_day(end)
+        type_filter, type_params = _doc_type_filter(doc_types)
+        with get_conn() as conn:
+            return _document_rows(conn.execute(
+                f"""SELECT v.name, v.plate_number, d.doc_type, d.expiry_day
+                    FROM documents d JOIN vehicles v ON v.id = d.vehicle_id
+                    WHERE d.expiry_day BETWEEN ? AND ?{type_filter}
+                    ORDER BY d.expiry_day, d.doc_type""",
+                [low, high] + type_params))
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"خطأ في جلب الوثائق: {str(e)}")
+
+
+@instrument
+@_cached_query
+def get_vehicle_documents(plate):
+    try:
+        with get_conn() as conn:
+            return {doc_type: _from_day(day) for doc_type, day in conn.execute(
+                """SELECT d.doc_type, d.expiry_day
+                   FROM vehicles v JOIN documents d ON d.vehicle_id = v.id
+                   WHERE v.plate_number = ?""", (plate,))}
+    except Exception as e:
+        raise ValueError(f"خطأ في جلب الوثائق: {str(e)}")
+
+
+def _set_document(conn, plate, doc_type, day):
+    column = _VEHICLE_DOCUMENT_COLUMNS.get(doc_type)
+    if column:
+        row = conn.execute(f"""UPDATE vehicles SET {column} = ?
+                           WHERE plate_number = ? RETURNING id""",
+                           (day, plate)).fetchone()
+    else:
+        row = conn.execute("SELECT id FROM vehicles WHERE plate_number = ?",
+                           (plate,)).fetchone()
+    if row is None:
+        raise VehicleNotFoundError()
+    if column is None and day is None:
+        conn.execute("""DELETE FROM documents
+                     WHERE vehicle_id = ? AND doc_type = ?""",
+                     (row[0], doc_type))
+    elif column is None:
+        conn.execute("""INSERT INTO documents (vehicle_id, doc_type, expiry_day)
+                     VALUES (?, ?, ?)
+                     ON CONFLICT (vehicle_id, doc_type)
+                     DO UPDATE SET expiry_day = excluded.expiry_day""",
+                     (row[0], doc_type, day))
+    return True
+
+
+@instrument
+def set_document_expiry(plate, doc_type, expiry, wait=True):
+    # Registration and insurance stay columns of vehicles (and reach
+    # documents through triggers); other types live only in documents.
+    # An empty expiry removes the document.
+    try:
+        if doc_type not in DOCUMENT_TYPES:
+            raise ValueError(f"نوع وثيقة غير معروف: {doc_type}")
+        return _write(_set_document, (plate, doc_type, _to_day(expiry)), wait)
+    except DatabaseError:
+        raise
+    except Exception as e:
+        raise ValueError(f"خطأ في تحديث الوثيقة: {str(e)}")
+
+
+@instrument
+def find_expiring_documents(today, thresholds, last_scan=None):
+    # Documents whose days-remaining dropped to or below one of the
+    # thresholds since the last scan, plus the documents of vehicles
+    # written since then. last_scan is (scan_date, sync version read when
+    # that scan started); versions follow commit order, unlike the
+    # updated_at stamps. Each branch is one range scan, so the cost does
+    # not grow with the number of document types.
+    try:
+        horizon = _to_day(today) + max(thresholds)
+        if last_scan is None:
+            queries = ["SELECT vehicle_id, doc_type FROM documents "
+                       "WHERE expiry_day <= ?"]
+            params = [horizon]
+        else:
+            last_date, last_version = last_scan
+            queries = ["""SELECT vehicle_id, doc_type FROM documents
+                          WHERE expiry_day <= ? AND vehicle_id IN (
+                              SELECT id FROM vehicles WHERE row_version > ?)"""]
+            params = [horizon, last_version]
+            for days in thresholds:
+                queries.append("""SELECT vehicle_id, doc_type FROM documents
+                               WHERE expiry_day > ? AND expiry_day <= ?""")
+                params.extend([_to_day(last_date) + days,
+                               _to_day(today) + days])
+        with get_conn() as conn:
+            return _document_rows(conn.execute(
+                f"""SELECT v.name, v.plate_number, d.doc_type, d.expiry_day
+                    FROM ({" UNION ".join(queries)}) c
+                    JOIN documents d USING (vehicle_id, doc_type)
+                    JOIN vehicles v ON v.id = d.vehicle_id""",
+                params))
+    except Exception as e:
+        raise ValueError(f"خطأ في فحص تواريخ الانتهاء: {str(e)}")
+
+
+@instrument
+def filter_unsent_notifications(keys):
+    # keys are (plate_number, document, level, expiry) tuples.
+    try:
+        with get_conn() as conn:
+            return [key for key in keys if conn.execute(
+                """SELECT 1 FROM notification_log
+                   WHERE plate_number = ? AND document = ? AND level = ?
+                   AND expiry = ?""", key).fetchone() is None]
+    except Exception as e:
+        raise ValueError(f"خطأ في جلب سجل الإشعارات: {str(e)}")
+
+
+def _record_scan(conn, scan_date, started_at, version, sent_keys):
+    conn.executemany(f"""INSERT OR IGNORE INTO notification_log
+                     (plate_number, document, level, expiry, sent_at)
+                     VALUES (?, ?, ?, ?, {_NOW_SQL})""", sent_keys)
+    conn.execute("""INSERT INTO scan_runs (scan_date, started_at, row_version)
+                 VALUES (?, ?, ?)""",
+                 (scan_date.isoformat(), started_at, version))
+
+
+@instrument
+def record_scan(scan_date, started_at, version, sent_keys):
+    try:
+        _write(_record_scan, (scan_date, started_at, version,
+                              list(sent_keys)), True)
+    except DatabaseError:
+        raise
+    except Exception as e:
+        raise ValueError(f"خطأ في حفظ حالة الفحص: {str(e)}")
+
+
+@instrument
+def current_timestamp():
+    with get_conn() as conn:
+        return conn.execute(f"SELECT {_NOW_SQL}").fetchone()[0]
+
+
+@instrument
+def sync_version():
+    # The version of the latest committed change; every vehicle written
+    # later gets a higher row_version.
+    with get_conn() as conn:
+        return conn.execute("SELECT version FROM sync_state").fetchone()[0]
+
+
+def _backup_path(directory, suffix):
+    stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    path = Path(directory) / f"backup_{stamp}{suffix}"
+    counter = 1
+    # Creating the file claims the name, so two backups started in the
+    # same second never write to the same path.
+    while True:
+        try:
+            open(path, "x").close()
+            return path
+        except FileExistsError:
+            path = Path(directory) / f"backup_{stamp}_{counter}{suffix}"
+            counter += 1
+
+
+def _open_backup_file(path, compression):
+    if compression == "gzip":
+        import gzip
+        return gzip.open(path, "wt", encoding="utf-8")
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("ضغط zstd يتطلب تثبيت الحزمة zstandard")
+        import io
+        return io.TextIOWrapper(
+            zstandard.ZstdCompressor().stream_writer(open(path, "wb")),
+            encoding="utf-8")
+    return open(path, "w", encoding="utf-8")
+
+
+def _record_backup(conn, started_at, path, fmt, incremental, version):
+    conn.execute("""INSERT INTO backups
+                 (started_at, file, format, incremental, row_version)
+                 VALUES (?, ?, ?, ?, ?)""",
+                 (started_at, str(path), fmt, int(incremental), version))
+
+
+def _snapshot_backup(directory):
+    path = _backup_path(directory, ".db")
+    target = sqlite3.connect(path)
+    try:
+        with get_conn() as conn:
+            conn.execute("BEGIN")
+            started_at = conn.execute(f"SELECT {_NOW_SQL}").fetchone()[0]
+            version = conn.execute("SELECT version FROM sync_state").fetchone()[0]
+            conn.backup(target)
+            conn.commit()
+    except BaseException:
+        target.close()
+        path.unlink(missing_ok=True)
+        raise
+    target.close()
+    _write(_record_backup, (started_at, path, "sqlite", False, version), True)
+    return str(path)
+
+
+@instrument
+def backup_data(fmt="json", compression=None, incremental=False, directory="."):
     try:
         import json
-        vehicles = get_all_vehicles()
-        backup_data = {
-            "backup_date": datetime.datetime.now().isoformat(),
-            "vehicles": vehicles
-        }
-        backup_file = f"backup_{datetime.date.today().strftime('%Y%m%d')}.json"
-        with open(backup_file, 'w', encoding='utf-8') as f:
-            json.dump(backup_data, f, ensure_ascii=False, indent=2)
-        return backup_file
+        if fmt not in BACKUP_FORMATS:
+            raise ValueError(f"صيغة نسخ غير معروفة: {fmt}")
+        if compression not in BACKUP_COMPRESSIONS:
+            raise ValueError(f"نوع ضغط غير معروف: {compression}")
+        if fmt == "sqlite":
+            return _snapshot_backup(directory)
+
+        suffix = ".json" if fmt == "json" else ".ndjson"
+        suffix += {None: "", "gzip": ".gz", "zstd": ".zst"}[compression]
+        with get_conn() as conn:
+            # Read everything inside one transaction so the file is a
+            # consistent snapshot even while other sessions keep writing.
+            conn.execute("BEGIN")
+            started_at = conn.execute(f"SELECT {_NOW_SQL}").fetchone()[0]
+            version = conn.execute("SELECT version FROM sync_state").fetchone()[0]
+            # Incremental backups hold the vehicles changed after the last
+            # backup's row version plus the plates deleted since; with no
+            # versioned backup yet the backup is a full one.
+            since = since_version = None
+            if incremental:
+                since, since_version = conn.execute(
+                    """SELECT started_at, row_version FROM backups
+                       WHERE row_version IS NOT NULL
+                       ORDER BY id DESC LIMIT 1""").fetchone() or (None, None)
+            where, params = (("row_version > ?", (since_version,))
+                             if since_version is not None else ("1", ()))
+            core = ", ".join(f"'{doc_type}'"
+                             for doc_type in _VEHICLE_DOCUMENT_COLUMNS)
+            cursor = conn.execute(f"""SELECT name, plate_number,
+                                  {_day_to_text_sql("registration_expiry")},
+                                  {_day_to_text_sql("insurance_expiry")},
+                                  (SELECT json_group_object(
+                                      doc_type, {_day_to_text_sql("expiry_day")})
+                                   FROM documents
+                                   WHERE vehicle_id = vehicles.id
+                                   AND doc_type NOT IN ({core}))
+                                  FROM vehicles WHERE {where}""", params)
+            rows = (row[:4] if row[4] == "{}" else
+                    row[:4] + (json.loads(row[4]),) for row in cursor)
+            # Archived vehicles follow the live ones as JSON objects, so
+            # readers tell them apart from the [name, plate, ...] rows.
+            archive_where, archive_params = (
+                ("row_version > ?", (since_version,))
+                if since_version is not None else ("1", ()))
+
+            def archived():
+                for row in conn.execute(f"""SELECT vehicle_id, name,
+                        plate_number,
+                        {_day_to_text_sql("registration_expiry")},
+                        {_day_to_text_sql("insurance_expiry")},
+                        (SELECT json_group_object(
+                            key, {_day_to_text_sql("value")})
+                         FROM json_each(documents)),
+                        updated_at, archived_at, reason
+                        FROM vehicles_archive WHERE {archive_where}
+                        ORDER BY id""", archive_params):
+                    record = dict(zip(_ARCHIVE_BACKUP_FIELDS, row))
+                    record["documents"] = json.loads(record["documents"])
+                    yield record
+
+            rows = itertools.chain(rows, archived())
+            header = {
+                "backup_date": datetime.datetime.now().isoformat(),
+                "incremental": since_version is not None,
+                "since": since,
+                "since_version": since_version,
+                "version": version,
+                "archive": True,
+            }
+            if since_version is not None:
+                header["deleted"] = [plate for plate, in conn.execute(
+                    """SELECT plate_number FROM vehicle_tombstones
+                       WHERE row_version > ?""", (since_version,))]
+            path = _backup_path(directory, suffix)
+            try:
+                with _open_backup_file(path, compression) as f:
+                    if fmt == "ndjson":
+                        f.write(json.dumps(header, ensure_ascii=False) + "\n")
+                        for row in rows:
+                            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    else:
+                        f.write(json.dumps(header, ensure_ascii=False)[:-1])
+                        f.write(', "vehicles": [')
+                        for index, row in enumerate(rows):
+                            f.write(",\n" if index else "\n")
+                            f.write(json.dumps(row, ensure_ascii=False))
+                        f.write("\n]}\n")
+            except BaseException:
+                path.unlink(missing_ok=True)
+                raise
+            conn.commit()
+        _write(_record_backup, (started_at, path, fmt,
+                                since_version is not None, version), True)
+        return str(path)
+    except ValueError:
+        raise
     except Exception as e:
         raise ValueError(f"خطأ في النسخ الاحتياطي: {str(e)}")
 
 
-def restore_data(backup_file):
+@contextmanager
+def _open_backup_stream(source):
+    import io
+    owned = isinstance(source, (str, Path))
+    raw = open(source, "rb") if owned else source
     try:
-        import json
-        with open(backup_file, 'r', encoding='utf-8') as f:
-            backup_data = json.load(f)
-        vehicles = backup_data.get("vehicles", [])
-        restored_count = 0
-        for vehicle in vehicles:
+        raw.seek(0)
+        magic = raw.read(4)
+        raw.seek(0)
+        stream = raw
+        if magic[:2] == b"\x1f\x8b":
+            import gzip
+            stream = gzip.GzipFile(fileobj=raw)
+        elif magic == b"\x28\xb5\x2f\xfd":
             try:
-                add_vehicle(vehicle[0], vehicle[1], vehicle[2], vehicle[3])
-                restored_count += 1
-            except Exception:
-                continue
-        return restored_count
+                import zstandard
+            except ImportError:
+                raise ValueError("فك ضغط zstd يتطلب تثبيت الحزمة zstandard")
+            stream = zstandard.ZstdDecompressor().stream_reader(raw,
+                                                                closefd=False)
+        text = io.TextIOWrapper(stream, encoding="utf-8")
+        try:
+            yield text
+        finally:
+            # Leave caller-owned file objects (e.g. uploads) open.
+            text.detach()
+    finally:
+        if owned:
+            raw.close()
+
+
+def _iter_json_vehicles(f, first_line, chunk_size=1 << 16):
+    # Walks the "vehicles" array of a JSON backup one element at a time
+    # with raw_decode, so old indented backups stream as well.
+    import json
+    decoder = json.JSONDecoder()
+    buffer = first_line
+    while True:
+        start = buffer.find('"vehicles"')
+        bracket = buffer.find("[", start) if start >= 0 else -1
+        if bracket >= 0:
+            break
+        chunk = f.read(chunk_size)
+        if not chunk:
+            raise ValueError("لم يتم العثور على قائمة السيارات في الملف")
+        buffer += chunk
+    position = bracket + 1
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position < len(buffer) and buffer[position] == "]":
+            return
+        try:
+            if position >= len(buffer):
+                raise json.JSONDecodeError("", buffer, position)
+            value, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise ValueError("ملف النسخة الاحتياطية غير مكتمل")
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield value
+
+
+def _restore_archived(conn, record):
+    # Adds one archived vehicle from a backup unless the archive already
+    # holds it, under a new sync version; returns 1 when it was added.
+    import json
+    documents = {doc_type: _to_day(expiry) for doc_type, expiry
+                 in (record.get("documents") or {}).items()}
+    added = conn.execute(
+        """INSERT INTO vehicles_archive
+           (vehicle_id, name, plate_number, registration_expiry,
+            insurance_expiry, documents, updated_at, archived_at, reason,
+            row_version)
+           SELECT ?, ?, ?3, ?, ?, ?, ?, ?8, ?, version + 1 FROM sync_state
+           WHERE NOT EXISTS (SELECT 1 FROM vehicles_archive
+                             WHERE plate_number = ?3 AND archived_at = ?8)""",
+        (record["vehicle_id"], record["name"], record["plate_number"],
+         _to_day(record.get("registration_expiry")),
+         _to_day(record.get("insurance_expiry")),
+         json.dumps(documents) if documents else None,
+         record.get("updated_at"), record["archived_at"],
+         record["reason"])).rowcount
+    if added:
+        conn.execute("UPDATE sync_state SET version = version + 1")
+    return added
+
+
+def _backup_rows(f):
+    import json
+    first_line = f.readline()
+    try:
+        header = json.loads(first_line)
+    except json.JSONDecodeError:
+        return _iter_json_vehicles(f, first_line)
+    if isinstance(header, dict) and "vehicles" in header:
+        return iter(header["vehicles"])
+    return (json.loads(line) for line in f if line.strip())
+
+
+@instrument
+def read_backup_header(source):
+    import json
+    try:
+        with _open_backup_stream(source) as f:
+            text = f.readline()
+            try:
+                header = json.loads(text)
+            except json.JSONDecodeError:
+                # JSON backups keep the metadata before the vehicles list.
+                text += f.read(4096)
+                end = text.find('"vehicles"')
+                header = json.loads(text[:end].rstrip().rstrip(",") + "}")
+        header.pop("vehicles", None)
+        return header
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"خطأ في قراءة ملف النسخة الاحتياطية: {str(e)}")
+
+
+@instrument
+def restore_data(backup_file, policy="skip", chunk_size=None,
+                 batch_size=5000):
+    if policy not in RESTORE_POLICIES:
+        raise ValueError(f"سياسة استعادة غير معروفة: {policy}")
+    header = read_backup_header(backup_file)
+    # An incremental backup only holds the vehicles changed since its base,
+    # so it cannot stand in for the whole fleet.
+    if policy == "replace" and header.get("incremental"):
+        raise ValueError("لا يمكن استبدال جميع البيانات بنسخة تزايدية")
+
+    def restore(conn):
+        # Incremental backups list the plates deleted since their base.
+        deleted = header.get("deleted") or []
+        archived = 0
+
+        def live_rows(rows):
+            nonlocal archived
+            for row in rows:
+                if isinstance(row, dict):
+                    archived += _restore_archived(conn, row)
+                else:
+                    yield row
+
+        with _open_backup_stream(backup_file) as f:
+            if policy == "replace":
+                conn.execute("DELETE FROM vehicles")
+                # Only backups that carry the archive replace it.
+                if header.get("archive"):
+                    conn.execute("DELETE FROM vehicles_archive")
+            conn.executemany("DELETE FROM vehicles WHERE plate_number = ?",
+                             ((plate,) for plate in deleted))
+            report = _write_vehicles(
+                conn, live_rows(_backup_rows(f)),
+                "skip" if policy == "skip" else "update",
+                chunk_size, batch_size)
+        report["archived"] = archived
+        return report
+
+    try:
+        return _write(restore, (), True, exclusive=True)
+    except ValueError:
+        raise
     except Exception as e:
         raise ValueError(f"خطأ في استعادة البيانات: {str(e)}")
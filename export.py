@@ -0,0 +1,77 @@
+import csv
+import io
+
+import database
+from cache import LRUCache, memoize
+from utils import VEHICLE_COLUMNS_AR
+
+EXPORT_FORMATS = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+EXPORT_BATCH_SIZE = 5000
+
+_export_cache = LRUCache(maxsize=8)
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+def _write_xlsx(batches, buffer):
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("vehicles")
+    sheet.sheet_view.rightToLeft = True
+    sheet.append(VEHICLE_COLUMNS_AR)
+    for batch in batches:
+        for row in batch:
+            sheet.append(row)
+    workbook.save(buffer)
+
+
+def _write_csv(batches, buffer):
+    # utf-8-sig so Excel detects the encoding of the Arabic headers.
+    text = io.TextIOWrapper(buffer, encoding="utf-8-sig", newline="")
+    writer = csv.writer(text)
+    writer.writerow(VEHICLE_COLUMNS_AR)
+    for batch in batches:
+        writer.writerows(batch)
+    text.detach()
+
+
+def _write_parquet(batches, buffer):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("التصدير إلى Parquet يتطلب تثبيت الحزمة pyarrow")
+    schema = pa.schema([(col, pa.string()) for col in VEHICLE_COLUMNS_AR])
+    with pq.ParquetWriter(buffer, schema) as writer:
+        for batch in batches:
+            columns = [pa.array([_text(value) for value in column], pa.string())
+                       for column in zip(*batch)]
+            writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=schema))
+
+
+_WRITERS = {"xlsx": _write_xlsx, "csv": _write_csv, "parquet": _write_parquet}
+
+
+def _export_key(func, args, kwargs):
+    return (func.__name__, args, tuple(sorted(kwargs.items())),
+            database.data_version())
+
+
+@memoize(_export_cache, _export_key)
+def export_vehicles(fmt="xlsx"):
+    if fmt not in _WRITERS:
+        raise ValueError(f"صيغة تصدير غير معروفة: {fmt}")
+    try:
+        buffer = io.BytesIO()
+        _WRITERS[fmt](database.iter_vehicles(EXPORT_BATCH_SIZE), buffer)
+        return buffer.getvalue()
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"خطأ في تصدير البيانات: {str(e)}")
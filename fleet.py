@@ -0,0 +1,167 @@
+import datetime
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+
+import database
+from metrics import instrument
+from utils import (EXPIRY_COLUMNS_AR, STATUS_COLUMN_AR, STATUS_LABELS_AR,
+                   VEHICLE_COLUMNS_AR, WARNING_DAYS, classify_expiry_days,
+                   set_cache_key)
+
+NO_DAY = np.iinfo(np.int32).min
+# Change sets touching more than this share of the fleet are applied by
+# reloading the snapshot instead of patching it.
+REBUILD_FRACTION = 0.25
+STATUS_CODES = {"expired": 0, "near_expiry": 1, "valid": 2}
+
+_snapshot = None
+_checked = None
+_lock = threading.Lock()
+
+
+def _days(values, count):
+    return np.fromiter((NO_DAY if day is None else day for day in values),
+                       dtype=np.int32, count=count)
+
+
+def _dates(days):
+    dates = days.astype("datetime64[D]")
+    dates[days == NO_DAY] = np.datetime64("NaT")
+    return pd.to_datetime(dates)
+
+
+class FleetSnapshot:
+    # Read-only copy of the live fleet shared by every session. Names are
+    # interned, expiry dates are int32 days since 1970-01-01 (NO_DAY when
+    # missing), earliest is the earliest expiry over all of a vehicle's
+    # documents and version is the database sync version it reflects.
+    # Arrays are never written after construction; patched() returns a
+    # new snapshot.
+
+    def __init__(self, names, plates, registration, insurance, earliest,
+                 version):
+        self.names = names
+        self.plates = plates
+        self.registration = registration
+        self.insurance = insurance
+        self.earliest = earliest
+        self.version = version
+        for array in (names, plates, registration, insurance, earliest):
+            array.flags.writeable = False
+        self._frames = {}
+        self._frames_lock = threading.Lock()
+        self._plate_index = None
+
+    def __len__(self):
+        return len(self.plates)
+
+    @staticmethod
+    def _arrays(rows):
+        names, plates, registration, insurance, earliest = (
+            zip(*rows) if rows else ((), (), (), (), ()))
+        return (np.array([sys.intern(name) for name in names], dtype=object),
+                np.array(plates, dtype=object),
+                _days(registration, len(rows)), _days(insurance, len(rows)),
+                _days(earliest, len(rows)))
+
+    @classmethod
+    @instrument
+    def load(cls):
+        rows, _, version = database.read_changes(0)
+        return cls(*cls._arrays(rows), version)
+
+    @instrument
+    def patched(self, rows, deleted, version):
+        # Changed vehicles are dropped from their old position and appended
+        # with their new values.
+        removed = np.array(list(deleted) + [row[1] for row in rows],
+                           dtype=object)
+        keep = ~np.isin(self.plates, removed)
+        current = (self.names, self.plates, self.registration, self.insurance,
+                   self.earliest)
+        return FleetSnapshot(*(np.concatenate([old[keep], new])
+                               for old, new in zip(current,
+                                                   self._arrays(rows))),
+                             version)
+
+    def status_codes(self, today=None, warning_days=WARNING_DAYS):
+        today = np.datetime64(today or datetime.date.today(), "D")
+        days = (self.earliest.astype(np.int64)
+                - today.astype(np.int64))[:, None]
+        return classify_expiry_days(days, (self.earliest == NO_DAY)[:, None],
+                                    warning_days)
+
+    def status_counts(self, today=None):
+        codes = self.status_codes(today)
+        counts = np.bincount(codes[codes >= 0], minlength=len(STATUS_CODES))
+        return {"total": len(self),
+                **{status: int(counts[code])
+                   for status, code in STATUS_CODES.items()}}
+
+    @instrument
+    def frame(self, status=None, today=None):
+        # One DataFrame per status and day, shared by every session that
+        # reads this snapshot; callers must not modify it.
+        today = today or datetime.date.today()
+        with self._frames_lock:
+            df = self._frames.get((status, today))
+            if df is not None:
+                return df
+            codes = self.status_codes(today)
+            rows = (np.flatnonzero(codes == STATUS_CODES[status])
+                    if status in STATUS_CODES else slice(None))
+            df = pd.DataFrame({
+                VEHICLE_COLUMNS_AR[0]: self.names[rows],
+                VEHICLE_COLUMNS_AR[1]: self.plates[rows],
+                EXPIRY_COLUMNS_AR[0]: _dates(self.registration[rows]),
+                EXPIRY_COLUMNS_AR[1]: _dates(self.insurance[rows]),
+                STATUS_COLUMN_AR: pd.Categorical.from_codes(
+                    codes[rows], categories=STATUS_LABELS_AR),
+            })
+            set_cache_key(df, ("fleet", self.version, status, today))
+            self._frames = {key: value for key, value in self._frames.items()
+                            if key[1] == today}
+            self._frames[(status, today)] = df
+            return df
+
+
+    def statuses(self, plates, today=None):
+        # Status labels for vehicles read from the database rather than
+        # from a snapshot frame (NaN for plates the snapshot lacks), so
+        # every table classifies by the same earliest expiry.
+        codes = self.frame(None, today)[STATUS_COLUMN_AR].cat.codes.to_numpy()
+        with self._frames_lock:
+            if self._plate_index is None:
+                self._plate_index = pd.Index(self.plates)
+        # get_indexer gives -1 for unknown plates, which picks the
+        # appended -1 (no status) code.
+        positions = self._plate_index.get_indexer(plates)
+        return pd.Categorical.from_codes(np.append(codes, -1)[positions],
+                                         categories=STATUS_LABELS_AR)
+
+
+@instrument
+def get_snapshot():
+    # Checks PRAGMA data_version (through database.data_version()) and,
+    # after a commit, applies the change feed since the snapshot's
+    # version; a new database file or a large change set reloads it.
+    global _snapshot, _checked
+    with _lock:
+        data_version = database.data_version()
+        if _snapshot is not None and _checked == data_version:
+            return _snapshot
+        if _snapshot is None or _checked[0] != data_version[0]:
+            _snapshot = FleetSnapshot.load()
+        else:
+            rows, deleted, version = database.read_changes(_snapshot.version)
+            if version < _snapshot.version or (
+                    len(rows) + len(deleted)
+                    > REBUILD_FRACTION * max(len(_snapshot), 1)):
+                _snapshot = FleetSnapshot.load()
+            elif version != _snapshot.version:
+                _snapshot = _snapshot.patched(rows, deleted, version)
+        _checked = data_version
+        return _snapshot
@@ -0,0 +1,130 @@
+import csv
+import io
+import itertools
+
+import database
+
+IMPORT_CHUNK_SIZE = 5000
+
+
+def _cell_text(value):
+    if value is None or value != value:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value).strip()
+    return value or None
+
+
+def _excel_rows(source):
+    from openpyxl import load_workbook
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        total = sheet.max_row - 1 if sheet.max_row else None
+        rows = sheet.iter_rows(min_row=2, values_only=True)
+        yield total
+        yield from rows
+    finally:
+        workbook.close()
+
+
+def _csv_rows(source):
+    raw = open(source, "rb") if isinstance(source, str) else source
+    raw.seek(0)
+    text = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+    try:
+        reader = csv.reader(text)
+        next(reader, None)
+        yield None
+        yield from reader
+    finally:
+        text.detach()
+        if raw is not source:
+            raw.close()
+
+
+def _source_rows(source, kind):
+    rows = _excel_rows(source) if kind == "xlsx" else _csv_rows(source)
+    total = next(rows)
+    return total, rows
+
+
+def normalize_chunk(rows, start=0):
+    valid = []
+    errors = []
+    width = 4
+    # Blank CSV lines and formatted but empty spreadsheet rows are not
+    # records; they keep their index so later rows are numbered as in
+    # the file.
+    padded = [(index, tuple(row[:width]) + (None,) * (width - len(row[:width])))
+              for index, row in enumerate(rows, start)
+              if any(_cell_text(cell) is not None for cell in row)]
+    if not padded:
+        return valid, errors
+    indexes, padded = zip(*padded)
+    names, plates, regs, inss = zip(*padded)
+    reg_dates = database.parse_dates(regs)
+    ins_dates = database.parse_dates(inss)
+    for index, name, plate, reg, ins, reg_cell, ins_cell in zip(
+            indexes, names, plates, reg_dates, ins_dates, regs, inss):
+        name, plate = _cell_text(name), _cell_text(plate)
+        if not name or not plate:
+            error = "اسم السيارة ورقم اللوحة مطلوبان"
+        elif ((reg is None and _cell_text(reg_cell) is not None)
+              or (ins is None and _cell_text(ins_cell) is not None)):
+            # Empty date cells are imported as missing dates; only text
+            # that does not parse is rejected.
+            error = "تاريخ انتهاء غير صالح"
+        else:
+            valid.append((index, (name, plate, reg, ins)))
+            continue
+        errors.append({"index": index, "plate": plate, "status": "failed",
+                       "error": error})
+    return valid, errors
+
+
+def preview_import(source, kind, limit=5):
+    _, rows = _source_rows(source, kind)
+    preview = [tuple(row[:4]) for row in itertools.islice(rows, limit)]
+    rows.close()
+    return preview
+
+
+def import_vehicles(source, kind="xlsx", on_conflict="skip",
+                    chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    report = {"inserted": 0, "updated": 0, "skipped": 0, "failed": 0,
+              "errors": []}
+    try:
+        total, rows = _source_rows(source, kind)
+    except Exception as e:
+        raise ValueError(f"خطأ في قراءة الملف: {str(e)}")
+    try:
+        processed = 0
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            valid, errors = normalize_chunk(chunk, processed)
+            report["failed"] += len(errors)
+            report["errors"].extend(errors)
+            if valid:
+                # One transaction per chunk keeps the write lock short.
+                written = database.bulk_add_vehicles(
+                    [row for _, row in valid], on_conflict=on_conflict)
+                for key in ("inserted", "updated", "skipped", "failed"):
+                    report[key] += written[key]
+                for error in written["errors"]:
+                    error["index"] = valid[error["index"]][0]
+                    report["errors"].append(error)
+            processed += len(chunk)
+            if progress is not None:
+                progress(processed, total)
+        report["errors"].sort(key=lambda error: error["index"])
+        return report
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"خطأ في استيراد الملف: {str(e)}")
+    finally:
+        rows.close()
@@ -0,0 +1,266 @@
+import functools
+import math
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+MAX_SAMPLES = 1000
+MAX_RUNS = 200
+MAX_STATEMENTS = 5
+MAX_STATEMENT_LENGTH = 500
+SLOW_CALL_COUNT = 20
+PROMETHEUS_FILE = os.environ.get("EXPIRY_TRACKER_PROMETHEUS_FILE")
+PROMETHEUS_INTERVAL = 15
+PROMETHEUS_PREFIX = "expiry_tracker"
+
+_lock = threading.Lock()
+_local = threading.local()
+_samples = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))
+# name -> [calls, seconds, rows, queries], never trimmed so the Prometheus
+# counters stay monotonic.
+_totals = defaultdict(lambda: [0, 0.0, 0, 0])
+_slow_calls = []
+_runs = deque(maxlen=MAX_RUNS)
+_open_runs = []
+_last_export = 0.0
+
+
+class _Call:
+    __slots__ = ("statements", "queries")
+
+    def __init__(self):
+        self.statements = []
+        self.queries = 0
+
+
+def trace_statement(statement):
+    # Attributes each executed statement to the innermost instrumented
+    # call (and the rerun) on this thread.
+    stack = getattr(_local, "stack", None)
+    if stack:
+        call = stack[-1]
+        call.queries += 1
+        statement = " ".join(statement.split())[:MAX_STATEMENT_LENGTH]
+        if (len(call.statements) < MAX_STATEMENTS
+                and statement not in call.statements):
+            call.statements.append(statement)
+    run = getattr(_local, "run", None)
+    if run is not None:
+        run["queries"] += 1
+
+
+def _row_count(result):
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])
+    shape = getattr(result, "shape", None)
+    if shape:
+        return shape[0]
+    return None
+
+
+def _record(name, duration, rows, call):
+    run = getattr(_local, "run", None)
+    with _lock:
+        _samples[name].append(duration)
+        totals = _totals[name]
+        totals[0] += 1
+        totals[1] += duration
+        totals[2] += rows or 0
+        totals[3] += call.queries
+        if call.statements and (len(_slow_calls) < SLOW_CALL_COUNT
+                                or duration > _slow_calls[-1]["duration"]):
+            _slow_calls.append({
+                "function": name, "duration": duration, "rows": rows,
+                "queries": call.queries, "statements": call.statements,
+                "page": run["page"] if run is not None else None,
+            })
+            _slow_calls.sort(key=lambda entry: entry["duration"], reverse=True)
+            del _slow_calls[SLOW_CALL_COUNT:]
+    if run is not None:
+        run["calls"] += 1
+        run["functions"][name] += duration
+        run["last"] = time.perf_counter()
+
+
+def instrument(func):
+    name = f"{func.__module__}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        call = _Call()
+        stack.append(call)
+        rows = None
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+            rows = _row_count(result)
+            return result
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            _record(name, duration, rows, call)
+    return wrapper
+
+
+def _close_run(run, end, complete):
+    with _lock:
+        if run not in _open_runs:
+            return
+        _open_runs.remove(run)
+        _runs.append({
+            "page": run["page"],
+            "started": run["started"],
+            "duration": end - run["start"],
+            "calls": run["calls"],
+            "queries": run["queries"],
+            "functions": dict(run["functions"]),
+            "complete": complete,
+        })
+
+
+def begin_run(page):
+    # A rerun cut short by st.rerun() or st.stop() never reaches end_run;
+    # close it up to its last recorded call once its thread is done.
+    current = threading.current_thread()
+    with _lock:
+        stale = [run for run in _open_runs
+                 if run["thread"] is current or not run["thread"].is_alive()]
+    for run in stale:
+        _close_run(run, run["last"], False)
+
+    start = time.perf_counter()
+    run = {"page": page, "started": time.time(), "start": start,
+           "last": start, "calls": 0, "queries": 0,
+           "functions": defaultdict(float), "thread": current}
+    with _lock:
+        _open_runs.append(run)
+    _local.run = run
+    return run
+
+
+def end_run(run=None):
+    run = run or getattr(_local, "run", None)
+    if run is None:
+        return
+    _close_run(run, time.perf_counter(), True)
+    if getattr(_local, "run", None) is run:
+        _local.run = None
+    if PROMETHEUS_FILE and time.time() - _last_export >= PROMETHEUS_INTERVAL:
+        write_prometheus(PROMETHEUS_FILE)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def function_summary():
+    with _lock:
+        items = [(name, list(samples), list(_totals[name]))
+                 for name, samples in _samples.items()]
+    summary = [{
+        "function": name,
+        "calls": totals[0],
+        "p50": percentile(samples, 0.5),
+        "p95": percentile(samples, 0.95),
+        "max": max(samples),
+        "rows": totals[2] / totals[0],
+        "queries": totals[3] / totals[0],
+    } for name, samples, totals in items]
+    return sorted(summary, key=lambda entry: entry["p95"], reverse=True)
+
+
+def page_summary():
+    with _lock:
+        runs = list(_runs)
+    pages = defaultdict(list)
+    for run in runs:
+        pages[run["page"]].append(run)
+    return [{
+        "page": page,
+        "runs": len(page_runs),
+        "p50": percentile([run["duration"] for run in page_runs], 0.5),
+        "p95": percentile([run["duration"] for run in page_runs], 0.95),
+        "queries": sum(run["queries"] for run in page_runs) / len(page_runs),
+        "calls": sum(run["calls"] for run in page_runs) / len(page_runs),
+    } for page, page_runs in pages.items()]
+
+
+def recent_runs(limit=20):
+    with _lock:
+        return list(_runs)[-limit:][::-1]
+
+
+def slow_calls():
+    with _lock:
+        return list(_slow_calls)
+
+
+def reset():
+    with _lock:
+        _samples.clear()
+        _totals.clear()
+        _slow_calls.clear()
+        _runs.clear()
+
+
+def _label(value):
+    return (str(value).replace("\\", "\\\\").replace('"', '\\"')
+            .replace("\n", "\\n"))
+
+
+def prometheus_text():
+    with _lock:
+        items = [(name, list(samples), list(_totals[name]))
+                 for name, samples in _samples.items()]
+    metric = f"{PROMETHEUS_PREFIX}_call_duration_seconds"
+    lines = [f"# HELP {metric} Duration of instrumented calls.",
+             f"# TYPE {metric} summary"]
+    for name, samples, totals in items:
+        label = f'function="{_label(name)}"'
+        for quantile in (0.5, 0.95):
+            lines.append(f'{metric}{{{label},quantile="{quantile}"}} '
+                         f"{percentile(samples, quantile)}")
+        lines.append(f"{metric}_sum{{{label}}} {totals[1]}")
+        lines.append(f"{metric}_count{{{label}}} {totals[0]}")
+    for suffix, index, help_text in (("rows", 2, "Rows returned"),
+                                     ("queries", 3, "SQL statements run")):
+        total_metric = f"{PROMETHEUS_PREFIX}_{suffix}_total"
+        lines.append(f"# HELP {total_metric} {help_text} by instrumented calls.")
+        lines.append(f"# TYPE {total_metric} counter")
+        for name, _, totals in items:
+            lines.append(f'{total_metric}{{function="{_label(name)}"}} '
+                         f"{totals[index]}")
+    run_metric = f"{PROMETHEUS_PREFIX}_rerun_duration_seconds"
+    lines.append(f"# HELP {run_metric} Duration of recent Streamlit reruns.")
+    lines.append(f"# TYPE {run_metric} gauge")
+    for page in page_summary():
+        for key, quantile in (("p50", 0.5), ("p95", 0.95)):
+            lines.append(f'{run_metric}{{page="{_label(page["page"])}",'
+                         f'quantile="{quantile}"}} {page[key]}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path):
+    # Written to a temporary file and renamed so a scraper (e.g. the
+    # node_exporter textfile collector) never reads a partial file.
+    import tempfile
+    global _last_export
+    _last_export = time.time()
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(prometheus_text())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
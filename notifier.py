@@ -0,0 +1,142 @@
+import argparse
+import datetime
+import json
+import smtplib
+import sys
+import time
+from email.message import EmailMessage
+from pathlib import Path
+
+import database
+from utils import (URGENT_DAYS, WARNING_DAYS, documents_frame,
+                   format_notification, get_document_notifications)
+
+SCAN_INTERVAL_SECONDS = 3600
+
+
+def stdout_sink(notifications):
+    for notification in notifications:
+        print(notification["message"], flush=True)
+
+
+def file_sink(path):
+    def send(notifications):
+        with open(path, "a", encoding="utf-8") as f:
+            for notification in notifications:
+                f.write(json.dumps(notification, ensure_ascii=False) + "\n")
+    return send
+
+
+def smtp_sink(host="localhost", port=25, sender="expiry-tracker@localhost",
+              recipient="fleet@localhost"):
+    def send(notifications):
+        if not notifications:
+            return
+        message = EmailMessage()
+        message["Subject"] = f"إشعارات انتهاء الصلاحية ({len(notifications)})"
+        message["From"] = sender
+        message["To"] = recipient
+        message.set_content("\n".join(n["message"] for n in notifications))
+        with smtplib.SMTP(host, int(port)) as server:
+            server.send_message(message)
+    return send
+
+
+def parse_sink(spec):
+    # stdout | file:PATH | smtp:HOST:PORT[:RECIPIENT]
+    kind, _, rest = spec.partition(":")
+    if kind == "stdout":
+        return stdout_sink
+    if kind == "file" and rest:
+        return file_sink(Path(rest))
+    if kind == "smtp":
+        parts = rest.split(":") if rest else []
+        keys = ("host", "port", "recipient")
+        return smtp_sink(**dict(zip(keys, parts)))
+    raise ValueError(f"وجهة إشعارات غير معروفة: {spec}")
+
+
+def run_scan(sinks=(stdout_sink,), today=None, urgent_days=URGENT_DAYS,
+             warning_days=WARNING_DAYS):
+    today = today or datetime.date.today()
+    started_at = database.current_timestamp()
+    # Read before the scan's queries: a write committed in between is seen
+    # now and looked at again next run, where notification_log drops it.
+    version = database.sync_version()
+    last_scan = database.get_last_scan()
+    rows = database.find_expiring_documents(
+        today, (warning_days, urgent_days, -1), last_scan)
+
+    df = documents_frame(rows)
+    found = get_document_notifications(df, today=today,
+                                       urgent_days=urgent_days,
+                                       warning_days=warning_days)
+    found = found.assign(expiry=[
+        (today + datetime.timedelta(days=int(days))).isoformat()
+        for days in found["days"]
+    ])
+    keys = list(zip(found["plate"], found["document"], found["type"],
+                    found["expiry"]))
+    unsent = set(database.filter_unsent_notifications(keys))
+
+    notifications = []
+    for key, notification in zip(keys, found.to_dict("records")):
+        if key in unsent:
+            notification["days"] = int(notification["days"])
+            notification["message"] = format_notification(notification)
+            notifications.append(notification)
+
+    for sink in sinks:
+        sink(notifications)
+    # Only record once every sink succeeded, so a failed delivery is
+    # retried on the next run.
+    database.record_scan(today, started_at, version, [
+        (n["plate"], n["document"], n["type"], n["expiry"])
+        for n in notifications
+    ])
+    return notifications
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="فحص دوري لتواريخ انتهاء الاستمارة والتأمين")
+    parser.add_argument("--db", help="مسار قاعدة البيانات")
+    parser.add_argument("--sink", action="append", default=[],
+                        help="stdout | file:PATH | smtp:HOST:PORT[:RECIPIENT]")
+    parser.add_argument("--interval", type=int, default=SCAN_INTERVAL_SECONDS,
+                        help="الفاصل بين عمليات الفحص بالثواني")
+    parser.add_argument("--once", action="store_true",
+                        help="تشغيل فحص واحد ثم الخروج")
+    parser.add_argument("--archive-after", type=int, metavar="DAYS",
+                        help="أرشفة السيارات المنتهية منذ أكثر من DAYS يوم "
+                             "بعد كل فحص")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        database.DB_FILE = Path(args.db)
+    database.initialize()
+    try:
+        sinks = [parse_sink(spec) for spec in args.sink or ["stdout"]]
+    except ValueError as e:
+        parser.error(str(e))
+
+    while True:
+        status = 0
+        try:
+            sent = run_scan(sinks)
+            print(f"[{datetime.datetime.now().isoformat(timespec='seconds')}] "
+                  f"تم إرسال {len(sent)} إشعار", file=sys.stderr, flush=True)
+            if args.archive_after is not None:
+                archived = database.archive_vehicles(args.archive_after)
+                print(f"تمت أرشفة {archived} سيارة", file=sys.stderr,
+                      flush=True)
+        except (ValueError, OSError) as e:
+            status = 1
+            print(f"خطأ في الفحص: {e}", file=sys.stderr, flush=True)
+        if args.once:
+            return status
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,22 +2,102 @@
 import streamlit as st
 import pandas as pd
 import datetime
-from database import (initialize, get_all_vehicles, add_vehicle,
-                      update_vehicle, delete_vehicle, search_vehicles,
-                      get_vehicles_by_status, backup_data, restore_data)
-from utils import (color_row, save_to_excel, VEHICLE_COLUMNS_AR,
-                   get_expiry_notifications, create_status_chart,
-                   create_expiry_timeline)
+import os
+import metrics
+from fleet import get_snapshot
+from database import (initialize, add_vehicle,
+                      update_vehicle, delete_vehicle,
+                      search_vehicles, list_vehicles,
+                      count_vehicles, get_status_summary, PAGE_SIZE,
+                      data_version, backup_data,
+                      read_backup_header, restore_data, DOCUMENT_TYPES,
+                      get_expiring_documents, get_vehicle_documents,
+                      set_document_expiry, get_vehicle, archive_vehicles,
+                      get_archived_vehicles, count_archived_vehicles,
+                      ARCHIVE_AFTER_DAYS)
+from export import EXPORT_FORMATS, export_vehicles
+from importer import import_vehicles, preview_import
+from utils import (color_rows, vehicles_frame, VEHICLE_COLUMNS_AR,
+                   STATUS_COLUMN_AR, STATUS_EXPIRED_AR, STATUS_NEAR_EXPIRY_AR, STATUS_VALID_AR,
+                   URGENT_DAYS, WARNING_DAYS, DOCUMENT_LABELS_AR,
+                   documents_frame, get_document_notifications,
+                   format_notification, create_status_chart,
+                   create_expiry_timeline, timeline_bin_vehicles,
+                   timeline_frequency)
+
+NOTIFICATIONS_PER_SECTION = 50
+PICKER_LIMIT = 50
+DASHBOARD_SEARCH_LIMIT = 1000
+TIMELINE_BIN_ROWS = 500
+STATUS_FILTERS = {"الكل": None, "منتهية": "expired",
+                  "قريبة من الانتهاء": "near_expiry", "صالحة": "valid"}
+BACKUP_OPTIONS = {
+    "JSON": ("json", None, "application/json"),
+    "NDJSON": ("ndjson", None, "application/x-ndjson"),
+    "NDJSON مضغوط (gzip)": ("ndjson", "gzip", "application/gzip"),
+    "لقطة SQLite": ("sqlite", None, "application/vnd.sqlite3"),
+}
+RESTORE_POLICY_LABELS = {
+    "skip": "تجاهل السيارات الموجودة",
+    "merge": "تحديث السيارات الموجودة",
+    "replace": "استبدال جميع البيانات بالنسخة",
+}
+EXPORT_LABELS = {"xlsx": "Excel (xlsx)", "csv": "CSV", "parquet": "Parquet"}
+ORDER_LABELS = {"name": "اسم السيارة", "plate_number": "رقم اللوحة",
+                "earliest_expiry": "أقرب تاريخ انتهاء"}
+PAGES = ["📊 لوحة التحكم", "📁 إدارة السيارات", "📤 تصدير البيانات",
+         "🔔 الإشعارات", "💾 النسخ الاحتياطي"]
+# Hidden unless the app is opened with ?perf=1.
+PERFORMANCE_PAGE = "⚙️ الأداء"
+
+
+def show_vehicle_table(key, status=None):
+    order_by = st.selectbox("ترتيب حسب", list(ORDER_LABELS),
+                            format_func=ORDER_LABELS.get, key=f"{key}_order")
+
+    # Keyset pagination: keep the start key of every visited page so
+    # "previous" can step back without OFFSET scans.
+    if st.session_state.get(f"{key}_filter") != (status, order_by):
+        st.session_state[f"{key}_filter"] = (status, order_by)
+        st.session_state[f"{key}_pages"] = [None]
+    pages = st.session_state[f"{key}_pages"]
+
+    try:
+        total = count_vehicles(status)
+        rows, next_key = list_vehicles(pages[-1], PAGE_SIZE, order_by, status)
+    except ValueError as e:
+        st.error(str(e))
+        return
+
+    page_df = vehicles_frame(rows)
+    status_labels = get_snapshot().statuses(page_df[VEHICLE_COLUMNS_AR[1]])
+    st.dataframe(page_df.style.apply(color_rows, axis=None,
+                                     status=status_labels),
+                 use_container_width=True)
+
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("⬅️ السابق", key=f"{key}_prev",
+                     disabled=len(pages) == 1, use_container_width=True):
+            pages.pop()
+            st.rerun()
+    with col2:
+        st.caption(f"الصفحة {len(pages)} من {max(1, -(-total // PAGE_SIZE))}"
+                   f" - {total} سيارة")
+    with col3:
+        if st.button("التالي ➡️", key=f"{key}_next",
+                     disabled=next_key is None, use_container_width=True):
+            pages.append(next_key)
+            st.rerun()
 
 
 st.set_page_config(page_title="لوحة متابعة السيارات", layout="wide")
 initialize()
 
 st.sidebar.title("🚗 لوحة التحكم")
-page = st.sidebar.radio("اختر الصفحة",
-                        ["📊 لوحة التحكم", "📁 إدارة السيارات",
-                         "📤 تصدير البيانات", "🔔 الإشعارات",
-                         "💾 النسخ الاحتياطي"])
+pages = PAGES + [PERFORMANCE_PAGE] if st.query_params.get("perf") else PAGES
+page = st.sidebar.radio("اختر الصفحة", pages)
+metrics.begin_run(page)
 
 if page == "📊 لوحة التحكم":
     st.title("📊 لوحة تحكم السيارات")
@@ -27,66 +107,61 @@ if page == "📊 لوحة التحكم":
         search_term = st.text_input("🔍 البحث عن سيارة (الاسم أو رقم اللوحة)")
     with col2:
         filter_status = st.selectbox("فلترة حسب الحالة",
-                                     ["الكل", "منتهية", "قريبة من الانتهاء", "صالحة"])
-
-    if search_term:
-        try:
-            vehicles_data = search_vehicles(search_term)
-        except ValueError as e:
-            st.error(str(e))
-            vehicles_data = []
-    elif filter_status == "منتهية":
-        try:
-            vehicles_data = get_vehicles_by_status("expired")
-        except ValueError as e:
-            st.error(str(e))
-            vehicles_data = []
-    elif filter_status == "قريبة من الانتهاء":
-        try:
-            vehicles_data = get_vehicles_by_status("near_expiry")
-        except ValueError as e:
-            st.error(str(e))
-            vehicles_data = []
-    else:
-        vehicles_data = get_all_vehicles()
-    
-    df = pd.DataFrame(vehicles_data, columns=VEHICLE_COLUMNS_AR)
-    if not df.empty:
-        df["انتهاء الاستمارة"] = pd.to_datetime(df["انتهاء الاستمارة"])
-        df["انتهاء التأمين"] = pd.to_datetime(df["انتهاء التأمين"])
+                                     list(STATUS_FILTERS))
+
+    status = STATUS_FILTERS[filter_status]
+    version = data_version()
+    # Without a search the dashboard reads the process-wide fleet
+    # snapshot; its frames are shared between sessions and already
+    # classified, so they are never modified here. Search results take
+    # their status from the same snapshot.
+    try:
+        if search_term:
+            df = vehicles_frame(search_vehicles(search_term,
+                                                DASHBOARD_SEARCH_LIMIT),
+                                cache_key=("dashboard", search_term, version))
+            df[STATUS_COLUMN_AR] = get_snapshot().statuses(
+                df[VEHICLE_COLUMNS_AR[1]])
+        else:
+            df = get_snapshot().frame(status)
+    except ValueError as e:
+        st.error(str(e))
+        df = vehicles_frame([])
+    if search_term and len(df) >= DASHBOARD_SEARCH_LIMIT:
+        st.caption(f"⚠️ تُعرض أول {DASHBOARD_SEARCH_LIMIT} نتيجة فقط، والأرقام "
+                   "والرسوم أدناه تخص هذه النتائج. اكتب نصاً أدق لتضييق البحث.")
 
     if df.empty:
         st.info("لا توجد بيانات لعرضها.")
     else:
-        today = pd.Timestamp.now().normalize()
-        df["انتهاء الاستمارة"] = pd.to_datetime(df["انتهاء الاستمارة"])
-        df["انتهاء التأمين"] = pd.to_datetime(df["انتهاء التأمين"])
-
-        expired = df[(df["انتهاء الاستمارة"] < today) |
-                     (df["انتهاء التأمين"] < today)]
-        near_expiry = df[
-            (((df["انتهاء الاستمارة"] - today).dt.days <= 30) &
-             ((df["انتهاء الاستمارة"] - today).dt.days >= 0)) |
-            (((df["انتهاء التأمين"] - today).dt.days <= 30) &
-             ((df["انتهاء التأمين"] - today).dt.days >= 0))
-        ]
-        valid = df[
-            ((df["انتهاء الاستمارة"] - today).dt.days > 30) &
-            ((df["انتهاء التأمين"] - today).dt.days > 30)
-        ]
+        if search_term:
+            counts = df[STATUS_COLUMN_AR].value_counts()
+            total_count = len(df)
+            expired_count = int(counts[STATUS_EXPIRED_AR])
+            near_expiry_count = int(counts[STATUS_NEAR_EXPIRY_AR])
+            valid_count = int(counts[STATUS_VALID_AR])
+        else:
+            summary = get_status_summary()
+            if status:
+                summary = {key: summary[status] if key in ("total", status) else 0
+                           for key in summary}
+            total_count = summary["total"]
+            expired_count = summary["expired"]
+            near_expiry_count = summary["near_expiry"]
+            valid_count = summary["valid"]
 
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("إجمالي السيارات", len(df))
+            st.metric("إجمالي السيارات", total_count)
         with col2:
-            st.metric("منتهية", len(expired),
-                      delta=f"-{len(expired)}" if len(expired) > 0 else None)
+            st.metric("منتهية", expired_count,
+                      delta=f"-{expired_count}" if expired_count > 0 else None)
         with col3:
-            st.metric("قريبة من الانتهاء", len(near_expiry),
-                      delta=f"⚠️ {len(near_expiry)}" if len(near_expiry) > 0 else None)
+            st.metric("قريبة من الانتهاء", near_expiry_count,
+                      delta=f"⚠️ {near_expiry_count}" if near_expiry_count > 0 else None)
         with col4:
-            st.metric("صالحة", len(valid),
-                      delta=f"✅ {len(valid)}" if len(valid) > 0 else None)
+            st.metric("صالحة", valid_count,
+                      delta=f"✅ {valid_count}" if valid_count > 0 else None)
 
         col1, col2 = st.columns(2)
         with col1:
@@ -96,16 +171,36 @@ if page == "📊 لوحة التحكم":
 
         with col2:
             timeline = create_expiry_timeline(df)
-            if timeline:
+            freq = timeline_frequency(df)
+            if timeline and freq:
+                event = st.plotly_chart(timeline, use_container_width=True,
+                                        on_select="rerun",
+                                        selection_mode="points",
+                                        key="timeline")
+                st.caption("اضغط على عمود لعرض السيارات في تلك الفترة.")
+            elif timeline:
                 st.plotly_chart(timeline, use_container_width=True)
+            st.caption("يعرض الجدول الزمني تواريخ الاستمارة والتأمين فقط، "
+                       "بينما تشمل الحالة جميع الوثائق.")
+
+        if timeline and freq and event.selection.points:
+            start = str(event.selection.points[0]["x"])[:10]
+            bin_df = timeline_bin_vehicles(df, start, freq)
+            st.subheader(f"🔎 السيارات التي تنتهي وثائقها في فترة {start} "
+                         f"({len(bin_df)})")
+            st.dataframe(bin_df.head(TIMELINE_BIN_ROWS)
+                         .style.apply(color_rows, axis=None),
+                         use_container_width=True)
 
         st.subheader("📋 جدول السيارات")
-        styled_df = df.style.apply(color_row, axis=1)
-        st.dataframe(styled_df, use_container_width=True)
+        if search_term:
+            styled_df = df.style.apply(color_rows, axis=None)
+            st.dataframe(styled_df, use_container_width=True)
+        else:
+            show_vehicle_table("dashboard", status)
 
 elif page == "📁 إدارة السيارات":
     st.title("📁 إدارة السيارات")
-    df = pd.DataFrame(get_all_vehicles(), columns=VEHICLE_COLUMNS_AR)
 
     with st.expander("➕ إضافة سيارة جديدة", expanded=True):
         with st.form("add_form", clear_on_submit=True):
@@ -126,126 +221,218 @@ elif page == "📁 إدارة السيارات":
                 else:
                     try:
                         add_vehicle(name.strip(), plate.strip(),
-                                    str(reg), str(ins))
+                                    reg, ins)
                         st.success("✅ تم إضافة السيارة بنجاح.")
                         st.rerun()
                     except ValueError as e:
                         st.error(str(e))
 
-    if df.empty:
+    if count_vehicles() == 0:
         st.warning("⚠️ لا توجد سيارات حالياً.")
     else:
         st.subheader("✏️ تعديل أو حذف سيارة")
+        # Only the vehicles matching the typed text (or the first page by
+        # name) are loaded; the options map plate -> row for the labels.
+        picker_term = st.text_input("🔍 ابحث بالاسم أو رقم اللوحة",
+                                    key="picker_term")
+        try:
+            if picker_term.strip():
+                picker_rows = search_vehicles(picker_term, PICKER_LIMIT)
+            else:
+                picker_rows, _ = list_vehicles(None, PICKER_LIMIT, "name")
+        except ValueError as e:
+            st.error(str(e))
+            picker_rows = []
+        options = {row[1]: row for row in picker_rows}
         selected = st.selectbox(
             "اختر السيارة للتعديل أو الحذف",
-            df["رقم اللوحة"],
-            format_func=lambda x: f"{df[df['رقم اللوحة'] == x]['اسم السيارة'].iloc[0]} - {x}"
+            list(options),
+            format_func=lambda plate: f"{options[plate][0]} - {plate}"
         )
-        selected_row = df[df["رقم اللوحة"] == selected].iloc[0]
+        if len(options) == PICKER_LIMIT:
+            st.caption(f"تُعرض أول {PICKER_LIMIT} نتيجة، اكتب للتضييق.")
+        selected_row = get_vehicle(selected) if selected else None
 
-        col1, col2 = st.columns([3, 1])
-        with col1:
-            with st.form("edit_form"):
-                col_a, col_b = st.columns(2)
-                with col_a:
-                    new_name = st.text_input("اسم السيارة",
-                                             value=selected_row["اسم السيارة"])
-                    new_reg = st.date_input("تاريخ الاستمارة",
-                                            value=selected_row["انتهاء الاستمارة"])
-                with col_b:
-                    st.text_input("رقم اللوحة", value=selected, disabled=True)
-                    new_ins = st.date_input("تاريخ التأمين",
-                                            value=selected_row["انتهاء التأمين"])
-
-                updated = st.form_submit_button("💾 تحديث السيارة",
-                                                use_container_width=True)
-                if updated:
-                    if not new_name:
-                        st.error("⚠️ اسم السيارة مطلوب")
+        if selected_row is None:
+            st.info("لا توجد سيارات مطابقة.")
+        else:
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                with st.form("edit_form"):
+                    col_a, col_b = st.columns(2)
+                    with col_a:
+                        new_name = st.text_input("اسم السيارة",
+                                                 value=selected_row[0])
+                        new_reg = st.date_input("تاريخ الاستمارة",
+                                                value=selected_row[2])
+                    with col_b:
+                        st.text_input("رقم اللوحة", value=selected, disabled=True)
+                        new_ins = st.date_input("تاريخ التأمين",
+                                                value=selected_row[3])
+
+                    updated = st.form_submit_button("💾 تحديث السيارة",
+                                                    use_container_width=True)
+                    if updated:
+                        if not new_name:
+                            st.error("⚠️ اسم السيارة مطلوب")
+                        else:
+                            try:
+                                update_vehicle(new_name.strip(), selected,
+                                               new_reg, new_ins)
+                                st.success("✅ تم التحديث بنجاح.")
+                                st.rerun()
+                            except ValueError as e:
+                                st.error(str(e))
+
+            with col2:
+                st.write("")
+                st.write("")
+                if st.button("🗑️ حذف السيارة", use_container_width=True,
+                             type="secondary"):
+                    if st.session_state.get('confirm_delete') != selected:
+                        st.session_state.confirm_delete = selected
+                        st.warning("⚠️ انقر مرة أخرى للتأكيد")
                     else:
                         try:
-                            update_vehicle(new_name.strip(), selected,
-                                           str(new_reg), str(new_ins))
-                            st.success("✅ تم التحديث بنجاح.")
+                            delete_vehicle(selected, archive=True)
+                            st.success("🚮 تم حذف السيارة ونقلها إلى الأرشيف.")
+                            if 'confirm_delete' in st.session_state:
+                                del st.session_state.confirm_delete
                             st.rerun()
                         except ValueError as e:
                             st.error(str(e))
 
-        with col2:
-            st.write("")
-            st.write("")
-            if st.button("🗑️ حذف السيارة", use_container_width=True,
-                         type="secondary"):
-                if st.session_state.get('confirm_delete') != selected:
-                    st.session_state.confirm_delete = selected
-                    st.warning("⚠️ انقر مرة أخرى للتأكيد")
-                else:
-                    try:
-                        delete_vehicle(selected)
-                        st.success("🚮 تم حذف السيارة بنجاح.")
-                        if 'confirm_delete' in st.session_state:
-                            del st.session_state.confirm_delete
-                        st.rerun()
-                    except ValueError as e:
-                        st.error(str(e))
+            with st.expander("📄 الوثائق الأخرى"):
+                extra_types = [doc_type for doc_type in DOCUMENT_TYPES
+                               if doc_type not in ("registration", "insurance")]
+                try:
+                    documents = get_vehicle_documents(selected)
+                except ValueError as e:
+                    st.error(str(e))
+                    documents = {}
+                for doc_type in extra_types:
+                    if doc_type in documents:
+                        st.write(f"• {DOCUMENT_LABELS_AR[doc_type]}: "
+                                 f"{documents[doc_type]}")
+
+                with st.form("document_form"):
+                    col_a, col_b = st.columns(2)
+                    with col_a:
+                        doc_type = st.selectbox("نوع الوثيقة", extra_types,
+                                                format_func=DOCUMENT_LABELS_AR.get)
+                    with col_b:
+                        doc_expiry = st.date_input("تاريخ الانتهاء")
+                    col_a, col_b = st.columns(2)
+                    with col_a:
+                        save_document = st.form_submit_button(
+                            "💾 حفظ الوثيقة", use_container_width=True)
+                    with col_b:
+                        remove_document = st.form_submit_button(
+                            "🗑️ إزالة الوثيقة", use_container_width=True)
+                    if save_document or remove_document:
+                        try:
+                            set_document_expiry(selected, doc_type,
+                                                doc_expiry if save_document else None)
+                            st.success("✅ تم تحديث الوثيقة.")
+                            st.rerun()
+                        except ValueError as e:
+                            st.error(str(e))
 
         st.subheader("📋 جميع السيارات")
-        styled_df = df.style.apply(color_row, axis=1)
-        st.dataframe(styled_df, use_container_width=True)
+        show_vehicle_table("manage")
+
+    with st.expander("🗄️ الأرشيف"):
+        # Archived vehicles are kept out of every other page.
+        archive_days = st.number_input("أرشفة السيارات المنتهية منذ أكثر من (يوم)",
+                                       min_value=0, value=ARCHIVE_AFTER_DAYS,
+                                       step=30)
+        if st.button("🗄️ أرشفة السيارات", use_container_width=True):
+            try:
+                archived = archive_vehicles(int(archive_days))
+                st.success(f"✅ تم نقل {archived} سيارة إلى الأرشيف.")
+            except ValueError as e:
+                st.error(str(e))
+        try:
+            archived_total = count_archived_vehicles()
+            if archived_total:
+                st.caption(f"{archived_total} سيارة في الأرشيف، "
+                           f"تُعرض آخر {PAGE_SIZE} منها.")
+                st.dataframe(vehicles_frame(get_archived_vehicles()),
+                             use_container_width=True)
+            else:
+                st.info("الأرشيف فارغ.")
+        except ValueError as e:
+            st.error(str(e))
 
 elif page == "📤 تصدير البيانات":
     st.title("📤 تصدير البيانات")
-    df = pd.DataFrame(get_all_vehicles(), columns=VEHICLE_COLUMNS_AR)
+    total = count_vehicles()
 
-    if df.empty:
+    if total == 0:
         st.warning("⚠️ لا توجد بيانات للتصدير.")
     else:
         st.subheader("📊 معاينة البيانات")
-        st.dataframe(df, use_container_width=True)
+        show_vehicle_table("export")
 
         col1, col2 = st.columns(2)
 
         with col1:
-            st.subheader("📥 تصدير إلى Excel")
-            st.write(f"📋 عدد السيارات: {len(df)}")
-
-            try:
-                file = save_to_excel(df)
-                with open(file, "rb") as f:
+            st.subheader("📥 تصدير البيانات")
+            st.write(f"📋 عدد السيارات: {total}")
+            export_format = st.selectbox("صيغة الملف", list(EXPORT_LABELS),
+                                         format_func=EXPORT_LABELS.get)
+
+            # The file is only built on request; the result is cached per
+            # data version so later reruns and other users reuse it.
+            if st.button("⚙️ تجهيز ملف التصدير", use_container_width=True):
+                st.session_state.export_format = export_format
+            if st.session_state.get("export_format") == export_format:
+                try:
                     st.download_button(
-                        "⬇️ تحميل ملف Excel",
-                        f,
-                        file_name=f"vehicles_{datetime.date.today().strftime('%Y%m%d')}.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        "⬇️ تحميل الملف",
+                        export_vehicles(export_format),
+                        file_name=f"vehicles_{datetime.date.today().strftime('%Y%m%d')}.{export_format}",
+                        mime=EXPORT_FORMATS[export_format],
                         use_container_width=True
                     )
-            except ValueError as e:
-                st.error(str(e))
+                except ValueError as e:
+                    st.error(str(e))
 
         with col2:
             st.subheader("📤 استيراد من Excel")
-            uploaded_file = st.file_uploader("اختر ملف Excel",
-                                              type=['xlsx', 'xls'])
+            uploaded_file = st.file_uploader("اختر ملف Excel أو CSV",
+                                              type=['xlsx', 'csv'])
 
             if uploaded_file is not None:
+                kind = "csv" if uploaded_file.name.lower().endswith(".csv") else "xlsx"
                 try:
-                    import_df = pd.read_excel(uploaded_file)
+                    preview = preview_import(uploaded_file, kind)
                     st.write("📋 معاينة البيانات المستوردة:")
-                    st.dataframe(import_df.head(), use_container_width=True)
+                    st.dataframe(pd.DataFrame(preview).astype(str),
+                                 use_container_width=True)
 
                     if st.button("📥 استيراد البيانات",
                                  use_container_width=True):
-                        imported_count = 0
                         errors = []
+                        imported_count = 0
+                        progress_bar = st.progress(0.0, text="جارٍ الاستيراد...")
 
-                        for _, row in import_df.iterrows():
-                            try:
-                                if len(row) >= 4:
-                                    add_vehicle(str(row.iloc[0]), str(row.iloc[1]),
-                                                str(row.iloc[2]), str(row.iloc[3]))
-                                    imported_count += 1
-                            except Exception as e:
-                                errors.append(f"الصف {_ + 1}: {str(e)}")
+                        def show_progress(processed, total):
+                            if total:
+                                progress_bar.progress(min(processed / total, 1.0),
+                                                      text=f"تمت معالجة {processed} من {total}")
+                            else:
+                                progress_bar.progress(0.0, text=f"تمت معالجة {processed} صف")
+
+                        try:
+                            report = import_vehicles(uploaded_file, kind,
+                                                     progress=show_progress)
+                            progress_bar.progress(1.0, text="اكتمل الاستيراد")
+                            imported_count = report["inserted"]
+                            errors = [f"الصف {e['index'] + 1}: {e['error']}"
+                                      for e in report["errors"]]
+                        except ValueError as e:
+                            errors.append(str(e))
 
                         if imported_count > 0:
                             st.success(f"✅ تم استيراد {imported_count} سيارة بنجاح.")
@@ -254,7 +441,7 @@ elif page == "📤 تصدير البيانات":
                             for error in errors[:5]:
                                 st.write(f"• {error}")
 
-                        if imported_count > 0:
+                        if imported_count > 0 and not errors:
                             st.rerun()
 
                 except Exception as e:
@@ -262,47 +449,46 @@ elif page == "📤 تصدير البيانات":
 
 elif page == "🔔 الإشعارات":
     st.title("🔔 إشعارات انتهاء الصلاحية")
-    df = pd.DataFrame(get_all_vehicles(), columns=VEHICLE_COLUMNS_AR)
+    version = data_version()
+    horizon = datetime.date.today() + datetime.timedelta(days=WARNING_DAYS)
+    df = documents_frame(get_expiring_documents(None, horizon),
+                         cache_key=("notifications", horizon, version))
 
-    if df.empty:
+    if count_vehicles() == 0:
         st.info("لا توجد سيارات للتحقق من إشعاراتها.")
     else:
-        notifications = get_expiry_notifications(df)
+        notifications = get_document_notifications(df)
 
-        if not notifications:
+        if notifications.empty:
             st.success("🎉 لا توجد إشعارات! جميع السيارات في حالة جيدة.")
         else:
-            expired_notifications = [n for n in notifications
-                                      if n["type"] == "expired"]
-            urgent_notifications = [n for n in notifications
-                                    if n["type"] == "urgent"]
-            warning_notifications = [n for n in notifications
-                                     if n["type"] == "warning"]
+            counts = notifications["type"].value_counts()
 
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.metric("🔴 منتهية الصلاحية", len(expired_notifications))
+                st.metric("🔴 منتهية الصلاحية", counts.get("expired", 0))
             with col2:
-                st.metric("🟠 عاجلة (أقل من 7 أيام)",
-                          len(urgent_notifications))
+                st.metric(f"🟠 عاجلة (أقل من {URGENT_DAYS} أيام)",
+                          counts.get("urgent", 0))
             with col3:
-                st.metric("🟡 تحذيرية (أقل من 30 يوم)",
-                          len(warning_notifications))
-
-            if expired_notifications:
-                st.subheader("🔴 إشعارات منتهية الصلاحية")
-                for notif in expired_notifications:
-                    st.error(notif["message"])
-
-            if urgent_notifications:
-                st.subheader("🟠 إشعارات عاجلة")
-                for notif in urgent_notifications:
-                    st.warning(notif["message"])
-
-            if warning_notifications:
-                st.subheader("🟡 إشعارات تحذيرية")
-                for notif in warning_notifications:
-                    st.info(notif["message"])
+                st.metric(f"🟡 تحذيرية (أقل من {WARNING_DAYS} يوم)",
+                          counts.get("warning", 0))
+
+            sections = [
+                ("expired", "🔴 إشعارات منتهية الصلاحية", st.error),
+                ("urgent", "🟠 إشعارات عاجلة", st.warning),
+                ("warning", "🟡 إشعارات تحذيرية", st.info),
+            ]
+            for kind, title, show in sections:
+                if counts.get(kind, 0) == 0:
+                    continue
+                st.subheader(title)
+                shown = notifications[notifications["type"] == kind]
+                for notif in shown.head(NOTIFICATIONS_PER_SECTION).to_dict("records"):
+                    show(format_notification(notif))
+                if len(shown) > NOTIFICATIONS_PER_SECTION:
+                    st.caption(f"... و {len(shown) - NOTIFICATIONS_PER_SECTION} "
+                               f"إشعارات أخرى")
 
 elif page == "💾 النسخ الاحتياطي":
     st.title("💾 النسخ الاحتياطي واستعادة البيانات")
@@ -311,20 +497,24 @@ elif page == "💾 النسخ الاحتياطي":
 
     with col1:
         st.subheader("📤 إنشاء نسخة احتياطية")
-        df = pd.DataFrame(get_all_vehicles(), columns=VEHICLE_COLUMNS_AR)
-        st.write(f"📋 عدد السيارات الحالية: {len(df)}")
+        st.write(f"📋 عدد السيارات الحالية: {count_vehicles()}")
+        backup_format = st.selectbox("صيغة النسخة", list(BACKUP_OPTIONS))
+        incremental = st.checkbox("نسخة تزايدية (التغييرات منذ آخر نسخة فقط)",
+                                  disabled=BACKUP_OPTIONS[backup_format][0] == "sqlite")
 
         if st.button("💾 إنشاء نسخة احتياطية", use_container_width=True):
             try:
-                backup_file = backup_data()
+                fmt, compression, mime = BACKUP_OPTIONS[backup_format]
+                backup_file = backup_data(fmt, compression,
+                                          incremental and fmt != "sqlite")
                 st.success(f"✅ تم إنشاء النسخة الاحتياطية: {backup_file}")
 
                 with open(backup_file, "rb") as f:
                     st.download_button(
                         "⬇️ تحميل النسخة الاحتياطية",
                         f,
-                        file_name=backup_file,
-                        mime="application/json",
+                        file_name=os.path.basename(backup_file),
+                        mime=mime,
                         use_container_width=True
                     )
             except ValueError as e:
@@ -333,31 +523,108 @@ elif page == "💾 النسخ الاحتياطي":
     with col2:
         st.subheader("📥 استعادة من نسخة احتياطية")
         uploaded_backup = st.file_uploader("اختر ملف النسخة الاحتياطية",
-                                            type=['json'])
+                                            type=['json', 'ndjson', 'gz', 'zst'])
 
         if uploaded_backup is not None:
             try:
-                import tempfile
-                with tempfile.NamedTemporaryFile(delete=False,
-                                                 suffix='.json') as tmp_file:
-                    tmp_file.write(uploaded_backup.getvalue())
-                    tmp_file_path = tmp_file.name
-
-                import json
-                with open(tmp_file_path, 'r', encoding='utf-8') as f:
-                    backup_data_content = json.load(f)
+                header = read_backup_header(uploaded_backup)
 
                 st.write("📋 معلومات النسخة الاحتياطية:")
-                st.write(f"• تاريخ النسخة: {backup_data_content.get('backup_date', 'غير محدد')}")
-                st.write(f"• عدد السيارات: {len(backup_data_content.get('vehicles', []))}")
+                st.write(f"• تاريخ النسخة: {header.get('backup_date', 'غير محدد')}")
+                if header.get("incremental"):
+                    st.write(f"• نسخة تزايدية منذ: {header.get('since')}")
+                    st.write(f"• سيارات محذوفة: {len(header.get('deleted') or [])}")
+
+                # Replacing is only offered for full backups.
+                policies = [policy for policy in RESTORE_POLICY_LABELS
+                            if policy != "replace"
+                            or not header.get("incremental")]
+                policy = st.radio("عند وجود رقم لوحة مسبقاً", policies,
+                                  format_func=RESTORE_POLICY_LABELS.get)
 
                 if st.button("🔄 استعادة البيانات", use_container_width=True):
                     try:
-                        restored_count = restore_data(tmp_file_path)
-                        st.success(f"✅ تم استعادة {restored_count} سيارة بنجاح.")
-                        st.rerun()
+                        report = restore_data(uploaded_backup, policy)
+                        st.success(f"✅ تمت الاستعادة: {report['inserted']} مضافة، "
+                                   f"{report['updated']} محدّثة، "
+                                   f"{report['skipped']} متجاهلة، "
+                                   f"{report['failed']} فاشلة، "
+                                   f"{report['archived']} مؤرشفة.")
+                        failures = [e for e in report["errors"]
+                                    if e["status"] == "failed"]
+                        for error in failures[:5]:
+                            st.write(f"• السجل {error['index'] + 1}: "
+                                     f"{error['error']}")
                     except ValueError as e:
                         st.error(str(e))
 
-            except Exception as e:
-                st.error(f"خطأ في قراءة ملف النسخة الاحتياطية: {str(e)}")
+            except ValueError as e:
+                st.error(str(e))
+
+elif page == PERFORMANCE_PAGE:
+    st.title("⚙️ الأداء")
+
+    def milliseconds(rows, columns):
+        df = pd.DataFrame(rows)
+        for col in columns:
+            df[col] = (df[col] * 1000).round(1)
+        return df
+
+    st.subheader("الصفحات (لكل إعادة تشغيل)")
+    pages_summary = metrics.page_summary()
+    if pages_summary:
+        st.dataframe(milliseconds(pages_summary, ["p50", "p95"]).rename(
+            columns={"page": "الصفحة", "runs": "مرات التشغيل",
+                     "p50": "p50 (ms)", "p95": "p95 (ms)",
+                     "queries": "متوسط الاستعلامات", "calls": "متوسط الاستدعاءات"}),
+            use_container_width=True)
+
+    st.subheader("الدوال")
+    functions = metrics.function_summary()
+    if functions:
+        st.dataframe(milliseconds(functions, ["p50", "p95", "max"]).rename(
+            columns={"function": "الدالة", "calls": "الاستدعاءات",
+                     "p50": "p50 (ms)", "p95": "p95 (ms)", "max": "الأقصى (ms)",
+                     "rows": "متوسط الصفوف", "queries": "متوسط الاستعلامات"}),
+            use_container_width=True)
+
+    st.subheader("آخر عمليات إعادة التشغيل")
+    runs = metrics.recent_runs()
+    if runs:
+        st.dataframe(milliseconds([{
+            "page": run["page"],
+            "duration": run["duration"],
+            "queries": run["queries"],
+            "calls": run["calls"],
+            "slowest": max(run["functions"], key=run["functions"].get,
+                           default=""),
+            "complete": run["complete"],
+        } for run in runs], ["duration"]).rename(
+            columns={"page": "الصفحة", "duration": "المدة (ms)",
+                     "queries": "الاستعلامات", "calls": "الاستدعاءات",
+                     "slowest": "أبطأ دالة", "complete": "مكتملة"}),
+            use_container_width=True)
+
+    st.subheader("أبطأ الاستدعاءات")
+    for call in metrics.slow_calls():
+        with st.expander(f"{call['function']} - {call['duration'] * 1000:.1f} ms"
+                         f" - {call['queries']} استعلام"):
+            st.caption(f"الصفحة: {call['page']} - الصفوف: {call['rows']}")
+            for statement in call["statements"]:
+                st.code(statement, language="sql")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("⬇️ تصدير بصيغة Prometheus",
+                           metrics.prometheus_text(),
+                           file_name="expiry_tracker.prom",
+                           mime="text/plain", use_container_width=True)
+    with col2:
+        if st.button("🗑️ تصفير القياسات", use_container_width=True):
+            metrics.reset()
+            st.rerun()
+    if metrics.PROMETHEUS_FILE:
+        st.caption(f"يتم تحديث الملف {metrics.PROMETHEUS_FILE} كل "
+                   f"{metrics.PROMETHEUS_INTERVAL} ثانية.")
+
+metrics.end_run()
@@ -0,0 +1,50 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    original = database.DB_FILE
+    database.close_all_connections()
+    database.DB_FILE = tmp_path / "vehicles.db"
+    database.initialize()
+    yield database
+    database.close_all_connections()
+    database.DB_FILE = original
+
+
+@pytest.fixture
+def query_plans(monkeypatch):
+    # Runs call() while recording the SELECTs it executes and returns the
+    # EXPLAIN QUERY PLAN details of each one, joined into one string.
+    def run(call):
+        statements = []
+        execute = database._TracedConnection.execute
+
+        def recording_execute(self, sql, *args):
+            statements.append((sql, args))
+            return execute(self, sql, *args)
+
+        database.invalidate_cache()
+        monkeypatch.setattr(database._TracedConnection, "execute",
+                            recording_execute)
+        try:
+            call()
+        finally:
+            monkeypatch.setattr(database._TracedConnection, "execute",
+                                execute)
+        plans = []
+        with database.get_conn() as conn:
+            for sql, args in statements:
+                if sql.lstrip().upper().startswith(("SELECT", "WITH")):
+                    plans.append(" | ".join(
+                        row[3] for row in
+                        conn.execute(f"EXPLAIN QUERY PLAN {sql}", *args)))
+        return plans
+    return run
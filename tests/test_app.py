@@ -0,0 +1,52 @@
+import subprocess
+import sys
+import time
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import benchmark
+import database
+
+# The fleet size the budgets in benchmark.TARGETS are set for.
+APP_FLEET_SIZE = 100_000
+
+
+@pytest.fixture(scope="module")
+def fleet_file(tmp_path_factory):
+    original = database.DB_FILE
+    database.close_all_connections()
+    database.DB_FILE = tmp_path_factory.mktemp("app") / "vehicles.db"
+    database.initialize()
+    database.bulk_add_vehicles(benchmark.generate_fleet(APP_FLEET_SIZE))
+    yield database.DB_FILE
+    database.close_all_connections()
+    database.DB_FILE = original
+
+
+def test_cold_start_within_budget(fleet_file):
+    start = time.perf_counter()
+    done = subprocess.run([sys.executable, "-c", benchmark.COLD_START_CODE,
+                           str(fleet_file), str(benchmark.APP_SCRIPT)],
+                          cwd=benchmark.APP_SCRIPT.parent,
+                          capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    assert done.returncode == 0, done.stderr[-500:]
+    assert elapsed < benchmark.TARGETS["cold_start"], elapsed
+
+
+def test_page_reruns_within_budget(fleet_file):
+    app = AppTest.from_file(str(benchmark.APP_SCRIPT), default_timeout=60)
+    start = time.perf_counter()
+    app.run()
+    assert not app.exception, app.exception
+    pages = app.sidebar.radio[0].options
+    timings = {pages[0]: time.perf_counter() - start}
+    for page in pages[1:]:
+        start = time.perf_counter()
+        app.sidebar.radio[0].set_value(page).run()
+        timings[page] = time.perf_counter() - start
+        assert not app.exception, (page, app.exception[0].value)
+    slow = {page: elapsed for page, elapsed in timings.items()
+            if elapsed >= benchmark.TARGETS["rerun"]}
+    assert not slow, slow
@@ -0,0 +1,109 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+
+@pytest.fixture
+def small_db(db):
+    db.bulk_add_vehicles([("تويوتا", "A1", "2030-01-01", "2030-02-01"),
+                          ("نيسان", "B2", "2020-01-01", None)])
+    return db
+
+
+def test_backup_path_claims_distinct_files(db, tmp_path):
+    with ThreadPoolExecutor(8) as pool:
+        paths = list(pool.map(lambda _: db._backup_path(tmp_path, ".json"),
+                              range(16)))
+    assert len(set(paths)) == 16
+    assert all(path.exists() for path in paths)
+
+
+@pytest.mark.parametrize("fmt", ["json", "ndjson", "sqlite"])
+def test_backups_started_together_get_their_own_file(small_db, tmp_path, fmt):
+    paths = [small_db.backup_data(fmt, directory=tmp_path) for _ in range(3)]
+    assert len(set(paths)) == 3
+    if fmt == "json":
+        for path in paths:
+            assert len(json.loads(open(path, encoding="utf-8").read())
+                       ["vehicles"]) == 2
+
+
+def test_restore_reads_legacy_missing_values(db, tmp_path):
+    backup = tmp_path / "legacy.json"
+    backup.write_text(json.dumps({
+        "backup_date": "2024-01-01T00:00:00",
+        "vehicles": [["تويوتا", "A1", "2030-01-01", "nan"],
+                     ["نيسان", "B2", "NaT", "None"]]}), encoding="utf-8")
+    report = db.restore_data(str(backup))
+    assert report["inserted"] == 2
+    assert sorted(db.get_all_vehicles()) == [
+        ("تويوتا", "A1", db._from_day(db._to_day("2030-01-01")), None),
+        ("نيسان", "B2", None, None)]
+
+
+def test_restore_counts_only_changed_rows_as_updated(small_db, tmp_path):
+    path = small_db.backup_data("json", directory=tmp_path)
+    small_db.update_vehicle("تويوتا", "A1", "2031-01-01", "2030-02-01")
+    report = small_db.restore_data(path, policy="merge")
+    assert report["updated"] == 1
+
+
+@pytest.mark.parametrize("fmt", ["json", "ndjson"])
+def test_backup_keeps_archived_vehicles(small_db, tmp_path, fmt):
+    small_db.set_document_expiry("A1", small_db.DOCUMENT_TYPES[2],
+                                 "2031-05-01")
+    small_db.delete_vehicle("A1", archive=True)
+    path = small_db.backup_data(fmt, directory=tmp_path)
+    assert small_db.read_backup_header(path)["archive"] is True
+
+    report = small_db.restore_data(path, policy="replace")
+    assert (report["inserted"], report["archived"]) == (1, 1)
+    assert small_db.count_archived_vehicles() == 1
+    with small_db.get_conn() as conn:
+        documents = conn.execute(
+            "SELECT documents FROM vehicles_archive").fetchone()[0]
+    assert json.loads(documents) == {
+        small_db.DOCUMENT_TYPES[2]: small_db._to_day("2031-05-01")}
+    assert [row[1] for row in small_db.get_archived_vehicles()] == ["A1"]
+
+    report = small_db.restore_data(path, policy="merge")
+    assert report["archived"] == 0
+    assert small_db.count_archived_vehicles() == 1
+
+
+def test_incremental_backup_holds_newly_archived_vehicles(small_db, tmp_path):
+    def archived_plates(path):
+        lines = [json.loads(line) for line in open(path, encoding="utf-8")]
+        return lines[0], [line["plate_number"] for line in lines[1:]
+                          if isinstance(line, dict)]
+
+    small_db.delete_vehicle("A1", archive=True)
+    full = small_db.backup_data("ndjson", directory=tmp_path)
+    small_db.delete_vehicle("B2", archive=True)
+    header, plates = archived_plates(
+        small_db.backup_data("ndjson", incremental=True, directory=tmp_path))
+    assert header["deleted"] == ["B2"]
+    assert plates == ["B2"]
+
+    # Vehicles restored into the archive are changes as well.
+    small_db.restore_data(full, policy="replace")
+    _, plates = archived_plates(
+        small_db.backup_data("ndjson", incremental=True, directory=tmp_path))
+    assert plates == ["A1"]
+    assert archived_plates(small_db.backup_data(
+        "ndjson", incremental=True, directory=tmp_path))[1] == []
+
+
+def test_incremental_backup_cannot_replace_the_fleet(small_db, tmp_path):
+    small_db.add_vehicle("هيونداي", "C3", "2030-03-01", None)
+    small_db.backup_data("json", directory=tmp_path)
+    small_db.update_vehicle("تويوتا", "A1", "2031-01-01", "2030-02-01")
+    path = small_db.backup_data("json", incremental=True, directory=tmp_path)
+    with pytest.raises(ValueError):
+        small_db.restore_data(path, policy="replace")
+    assert small_db.count_vehicles() == 3
+
+    report = small_db.restore_data(path, policy="merge")
+    assert report["failed"] == 0
+    assert small_db.count_vehicles() == 3
@@ -0,0 +1,96 @@
+import datetime
+
+
+def _row_version(db, plate):
+    with db.get_conn() as conn:
+        return conn.execute(
+            "SELECT row_version FROM vehicles WHERE plate_number = ?",
+            (plate,)).fetchone()[0]
+
+
+def _tombstones(db):
+    with db.get_conn() as conn:
+        return [plate for plate, in conn.execute(
+            "SELECT plate_number FROM vehicle_tombstones")]
+
+
+def _changes(db, since):
+    db.invalidate_cache()
+    return db.get_changes(since)
+
+
+def test_unchanged_writes_keep_the_version(db):
+    db.bulk_add_vehicles([("تويوتا", "A1", "2030-01-01", None),
+                          ("نيسان", "B2", None, "2030-06-01")])
+    db.set_document_expiry("A1", "inspection", "2030-03-01")
+    version = db.sync_version()
+    stamped = _row_version(db, "A1")
+
+    db.update_vehicle("تويوتا", "A1", "2030-01-01", None)
+    db.bulk_add_vehicles([("تويوتا", "A1", "2030-01-01", None),
+                          ("نيسان", "B2", None, "2030-06-01")],
+                         on_conflict="update")
+    db.set_document_expiry("A1", "inspection", "2030-03-01")
+
+    assert db.sync_version() == version
+    assert _row_version(db, "A1") == stamped
+    assert _changes(db, version) == ([], [], version)
+
+
+def test_changes_report_writes_and_deletes_in_order(db):
+    db.add_vehicle("تويوتا", "A1", "2030-01-01", None)
+    db.add_vehicle("نيسان", "B2", "2030-02-01", None)
+    since = db.sync_version()
+
+    db.update_vehicle("نيسان", "B2", "2030-02-01", "2030-09-01")
+    db.add_vehicle("كيا", "C3", None, None)
+    db.delete_vehicle("A1")
+
+    changed, deleted, version = _changes(db, since)
+    assert changed == [("نيسان", "B2", datetime.date(2030, 2, 1),
+                        datetime.date(2030, 9, 1)),
+                       ("كيا", "C3", None, None)]
+    assert deleted == ["A1"]
+    assert version == db.sync_version() == since + 3
+    assert _changes(db, version) == ([], [], version)
+
+
+def test_deleted_and_archived_plates_leave_tombstones(db):
+    db.bulk_add_vehicles([("تويوتا", "A1", "2030-01-01", None),
+                          ("نيسان", "B2", "2030-01-01", None),
+                          ("كيا", "C3", "2030-01-01", None)])
+    db.delete_vehicle("A1")
+    db.delete_vehicle("B2", archive=True)
+
+    assert sorted(_tombstones(db)) == ["A1", "B2"]
+    assert sorted(_changes(db, 0)[1]) == ["A1", "B2"]
+
+
+def test_re_added_plate_clears_its_tombstone(db):
+    db.add_vehicle("تويوتا", "A1", "2030-01-01", None)
+    db.delete_vehicle("A1")
+    since = db.sync_version()
+    db.add_vehicle("تويوتا", "A1", "2031-01-01", None)
+
+    assert _tombstones(db) == []
+    changed, deleted, _ = _changes(db, 0)
+    assert changed == [("تويوتا", "A1", datetime.date(2031, 1, 1), None)]
+    assert deleted == []
+    assert _changes(db, since)[0] == changed
+
+
+def test_extra_document_edits_stamp_the_vehicle(db):
+    db.bulk_add_vehicles([("تويوتا", "A1", "2030-01-01", None),
+                          ("نيسان", "B2", "2030-01-01", None)])
+    untouched = _row_version(db, "B2")
+
+    for expiry in ("2030-03-01", "2030-04-01", None):
+        since = db.sync_version()
+        db.set_document_expiry("A1", "inspection", expiry)
+        assert db.sync_version() == since + 1
+        assert _row_version(db, "A1") == since + 1
+        changed, deleted, _ = _changes(db, since)
+        assert [plate for _, plate, _, _ in changed] == ["A1"]
+        assert deleted == []
+
+    assert _row_version(db, "B2") == untouched
@@ -0,0 +1,86 @@
+import datetime
+
+import numpy as np
+import pytest
+
+import fleet
+
+TODAY = datetime.date.today()
+
+
+def _day(offset):
+    return TODAY + datetime.timedelta(days=offset)
+
+
+@pytest.fixture
+def snapshot_calls(db, monkeypatch):
+    monkeypatch.setattr(fleet, "_snapshot", None)
+    monkeypatch.setattr(fleet, "_checked", None)
+    db.bulk_add_vehicles([(f"سيارة {number}", f"P{number}",
+                           _day(number * 7 - 30), _day(number * 11 - 60))
+                          for number in range(20)])
+    # Counts how each get_snapshot() call brought the snapshot up to date.
+    calls = {"load": 0, "patched": 0}
+    for name in calls:
+        method = getattr(fleet.FleetSnapshot, name)
+
+        def counted(*args, _method=method, _name=name, **kwargs):
+            calls[_name] += 1
+            return _method(*args, **kwargs)
+        monkeypatch.setattr(fleet.FleetSnapshot, name, counted)
+    fleet.get_snapshot()
+    calls["load"] = 0
+    return calls
+
+
+def _rows(snapshot):
+    order = np.argsort(snapshot.plates)
+    return [array[order].tolist() for array in
+            (snapshot.names, snapshot.plates, snapshot.registration,
+             snapshot.insurance, snapshot.earliest)]
+
+
+def _check(db):
+    snapshot = fleet.get_snapshot()
+    fresh = fleet.FleetSnapshot.load()
+    assert snapshot.version == fresh.version == db.sync_version()
+    assert _rows(snapshot) == _rows(fresh)
+    db.invalidate_cache()
+    assert snapshot.status_counts() == db.get_status_summary()
+    return snapshot
+
+
+def test_snapshot_patches_follow_the_database(db, snapshot_calls):
+
+    db.add_vehicle("جديدة", "N1", _day(5), None)
+    _check(db)
+    db.update_vehicle("سيارة 3", "P3", _day(400), _day(-2))
+    _check(db)
+    db.delete_vehicle("P4")
+    snapshot = _check(db)
+    assert "P4" not in snapshot.plates
+    db.delete_vehicle("P5")
+    db.add_vehicle("عائدة", "P5", None, _day(90))
+    snapshot = _check(db)
+    assert list(snapshot.plates).count("P5") == 1
+    db.set_document_expiry("P6", "inspection", _day(-1))
+    snapshot = _check(db)
+    assert snapshot.statuses(["P6"])[0] == snapshot.statuses(["P3"])[0]
+    db.set_document_expiry("P6", "inspection", None)
+    _check(db)
+    db.delete_vehicle("P7", archive=True)
+    _check(db)
+
+    # Each change set above was applied to the snapshot, not reloaded;
+    # the extra load() calls are the fresh copies _check() compares with.
+    assert snapshot_calls["patched"] == 7
+    assert snapshot_calls["load"] == 7
+
+
+def test_large_change_sets_reload_the_snapshot(db, snapshot_calls):
+    db.bulk_add_vehicles([(f"سيارة {number}", f"P{number}", None, _day(-3))
+                          for number in range(10)], on_conflict="update")
+    db.delete_vehicle("P15")
+    _check(db)
+    assert snapshot_calls["patched"] == 0
+    assert snapshot_calls["load"] == 2
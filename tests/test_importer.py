@@ -0,0 +1,61 @@
+import importer
+
+
+def test_normalize_chunk_keeps_empty_dates():
+    valid, errors = importer.normalize_chunk([
+        ("تويوتا", "A1", "2030-01-31", ""),
+        ("نيسان", "B2", None, "31/01/2030"),
+        ("هيونداي", "C3"),
+    ])
+    assert errors == []
+    assert [row for _, row in valid] == [
+        ("تويوتا", "A1", "2030-01-31", None),
+        ("نيسان", "B2", None, "2030-01-31"),
+        ("هيونداي", "C3", None, None),
+    ]
+
+
+def test_normalize_chunk_rejects_unreadable_dates():
+    valid, errors = importer.normalize_chunk([
+        ("تويوتا", "A1", "2030-01-31", "soon"),
+        ("نيسان", "B2", "2030-01-31", "2030-02-01"),
+    ], start=10)
+    assert [index for index, _ in valid] == [11]
+    assert [(error["index"], error["plate"]) for error in errors] == [
+        (10, "A1")]
+
+
+def test_import_vehicles_with_empty_dates(db, tmp_path):
+    source = tmp_path / "fleet.csv"
+    source.write_text("name,plate,registration,insurance\n"
+                      "تويوتا,A1,2030-01-31,\n"
+                      "نيسان,B2,,\n", encoding="utf-8")
+    report = importer.import_vehicles(str(source), kind="csv")
+    assert (report["inserted"], report["failed"]) == (2, 0)
+    assert db.count_vehicles() == 2
+
+
+def test_normalize_chunk_skips_empty_rows():
+    valid, errors = importer.normalize_chunk([
+        (), (None, None, None, None), ("", " ", None),
+        ("تويوتا", "A1", "2030-01-31", None),
+    ], start=5)
+    assert errors == []
+    assert [index for index, _ in valid] == [8]
+
+
+def test_import_excel_ignores_formatted_empty_rows(db, tmp_path):
+    from openpyxl import Workbook
+    from openpyxl.styles import Font
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(["name", "plate", "registration", "insurance"])
+    sheet.append(["تويوتا", "A1", "2030-01-31", None])
+    for row in range(3, 6):
+        for column in range(1, 5):
+            sheet.cell(row=row, column=column).font = Font(bold=True)
+    source = tmp_path / "fleet.xlsx"
+    workbook.save(source)
+    report = importer.import_vehicles(str(source), kind="xlsx")
+    assert (report["inserted"], report["failed"]) == (1, 0)
+    assert report["errors"] == []
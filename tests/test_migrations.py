@@ -0,0 +1,58 @@
+import datetime
+import logging
+import sqlite3
+
+import pytest
+
+import database
+
+
+@pytest.fixture
+def baseline_db(tmp_path):
+    # The schema the app shipped with before user_version was tracked.
+    path = tmp_path / "vehicles.db"
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE vehicles (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        plate_number TEXT UNIQUE,
+        registration_expiry TEXT,
+        insurance_expiry TEXT
+    )""")
+    conn.executemany(
+        "INSERT INTO vehicles (name, plate_number, registration_expiry, "
+        "insurance_expiry) VALUES (?, ?, ?, ?)",
+        [("تويوتا", "A1", "2025-01-31", "2025-03-01 00:00:00"),
+         ("نيسان", "B2", "01/02/2025", "31-12-2024"),
+         ("هيونداي", "C3", "", "nan"),
+         ("كيا", "D4", "next year", None)])
+    conn.commit()
+    conn.close()
+    original = database.DB_FILE
+    database.close_all_connections()
+    database.DB_FILE = path
+    yield database
+    database.close_all_connections()
+    database.DB_FILE = original
+
+
+def test_baseline_database_migrates_to_latest(baseline_db, caplog):
+    with caplog.at_level(logging.WARNING, logger="database"):
+        baseline_db.initialize()
+    with baseline_db.get_conn() as conn:
+        assert (conn.execute("PRAGMA user_version").fetchone()[0]
+                == len(baseline_db.MIGRATIONS))
+        rejected = conn.execute(
+            """SELECT plate_number, field, value
+               FROM rejected_expiry_dates""").fetchall()
+    date = datetime.date
+    assert sorted(baseline_db.get_all_vehicles()) == [
+        ("تويوتا", "A1", date(2025, 1, 31), date(2025, 3, 1)),
+        ("كيا", "D4", None, None),
+        ("نيسان", "B2", date(2025, 2, 1), date(2024, 12, 31)),
+        ("هيونداي", "C3", None, None),
+    ]
+    assert rejected == [("D4", "registration_expiry", "next year")]
+    assert "1 expiry dates could not be read" in caplog.text
+    assert baseline_db.get_status_summary()["total"] == 4
+    assert [row[1] for row in baseline_db.search_vehicles("نيسان")] == ["B2"]
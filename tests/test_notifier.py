@@ -0,0 +1,75 @@
+import datetime
+
+import pytest
+
+import notifier
+
+TODAY = datetime.date(2030, 1, 1)
+
+
+def _day(offset):
+    return TODAY + datetime.timedelta(days=offset)
+
+
+class Collect:
+    def __init__(self):
+        self.sent = []
+
+    def __call__(self, notifications):
+        self.sent.extend((n["plate"], n["document"], n["type"])
+                         for n in notifications)
+
+
+def _scan(today=TODAY):
+    sink = Collect()
+    notifier.run_scan([sink], today=today)
+    return sink.sent
+
+
+def test_notifications_are_sent_once_across_runs(db):
+    db.add_vehicle("تويوتا", "A1", _day(-3), _day(100))
+    assert _scan() == [("A1", "registration", "expired")]
+    assert _scan() == []
+    assert _scan(_day(1)) == []
+
+
+def test_threshold_crossed_after_a_day_passes(db):
+    db.add_vehicle("تويوتا", "A1", _day(31), _day(100))
+    assert _scan() == []
+    assert _scan(_day(1)) == [("A1", "registration", "warning")]
+
+
+def test_vehicle_edited_to_an_expired_date(db):
+    db.add_vehicle("تويوتا", "A1", _day(200), _day(300))
+    assert _scan() == []
+    db.update_vehicle("تويوتا", "A1", _day(-40), _day(300))
+    assert _scan() == [("A1", "registration", "expired")]
+
+
+def test_write_committed_during_a_scan_is_seen_next_run(db, monkeypatch):
+    db.add_vehicle("تويوتا", "A1", _day(200), _day(300))
+    assert _scan() == []
+    find = db.find_expiring_documents
+
+    def find_then_write(*args):
+        # The edit commits after the scan read the documents.
+        rows = find(*args)
+        db.update_vehicle("تويوتا", "A1", _day(-40), _day(300))
+        return rows
+
+    monkeypatch.setattr(db, "find_expiring_documents", find_then_write)
+    assert _scan() == []
+    monkeypatch.setattr(db, "find_expiring_documents", find)
+    assert _scan() == [("A1", "registration", "expired")]
+
+
+def test_failed_sink_records_no_scan(db):
+    db.add_vehicle("تويوتا", "A1", _day(-3), _day(100))
+
+    def broken(notifications):
+        raise OSError("smtp down")
+
+    with pytest.raises(OSError):
+        notifier.run_scan([broken], today=TODAY)
+    assert db.get_last_scan() is None
+    assert _scan() == [("A1", "registration", "expired")]
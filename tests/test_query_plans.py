@@ -0,0 +1,88 @@
+import datetime
+
+import pytest
+
+
+@pytest.fixture
+def fleet_db(db):
+    today = datetime.date.today()
+    db.bulk_add_vehicles(
+        (f"vehicle {i}", f"P{i}", today + datetime.timedelta(days=i - 100),
+         today + datetime.timedelta(days=i))
+        for i in range(500))
+    return db
+
+
+def _uses(plans, index):
+    return any(f"USING INDEX {index}" in plan
+               or f"USING COVERING INDEX {index}" in plan for plan in plans)
+
+
+@pytest.mark.parametrize("status", ["expired", "near_expiry", "valid"])
+def test_status_queries_use_earliest_expiry_index(fleet_db, query_plans,
+                                                  status):
+    plans = query_plans(lambda: fleet_db.get_vehicles_by_status(status))
+    assert any("SEARCH vehicles USING INDEX idx_vehicles_earliest_expiry"
+               in plan for plan in plans), plans
+
+
+def test_list_vehicles_by_name_uses_name_index(fleet_db, query_plans):
+    plans = query_plans(lambda: fleet_db.list_vehicles(None, 50, "name"))
+    assert _uses(plans, "idx_vehicles_name"), plans
+    key = fleet_db.list_vehicles(None, 50, "name")[1]
+    plans = query_plans(lambda: fleet_db.list_vehicles(key, 50, "name"))
+    assert _uses(plans, "idx_vehicles_name"), plans
+
+
+@pytest.mark.parametrize("status", ["expired", "near_expiry", "valid"])
+def test_list_vehicles_with_status_uses_earliest_expiry_index(
+        fleet_db, query_plans, status):
+    plans = query_plans(lambda: fleet_db.list_vehicles(
+        None, 50, "earliest_expiry", status))
+    assert _uses(plans, "idx_vehicles_earliest_expiry"), plans
+    for plan in plans:
+        assert "SCAN vehicles" not in plan, plans
+
+
+@pytest.mark.parametrize("order_by", ["name", "plate_number"])
+@pytest.mark.parametrize("status", ["expired", "near_expiry"])
+def test_list_vehicles_with_selective_status_reads_by_expiry(
+        fleet_db, query_plans, status, order_by):
+    plans = query_plans(lambda: fleet_db.list_vehicles(
+        None, 50, order_by, status))
+    assert _uses(plans, "idx_vehicles_earliest_expiry"), plans
+    assert not _uses(plans, "idx_vehicles_name"), plans
+
+
+def test_list_vehicles_with_common_status_walks_name_index(fleet_db,
+                                                           query_plans):
+    plans = query_plans(lambda: fleet_db.list_vehicles(
+        None, 50, "name", "valid"))
+    assert _uses(plans, "idx_vehicles_name"), plans
+
+
+@pytest.mark.parametrize("status", ["expired", "near_expiry", "valid"])
+def test_list_vehicles_pages_follow_order(fleet_db, status):
+    expected = sorted(row[:2] for row in fleet_db.get_vehicles_by_status(status))
+    pages, key = [], None
+    while True:
+        rows, key = fleet_db.list_vehicles(key, 50, "name", status)
+        pages.extend(row[:2] for row in rows)
+        if key is None:
+            break
+    assert pages == expected
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_find_expiring_documents_is_driven_by_range_scans(
+        fleet_db, query_plans, incremental):
+    today = datetime.date.today()
+    last_scan = ((today - datetime.timedelta(days=1),
+                  fleet_db.sync_version())
+                 if incremental else None)
+    plans = query_plans(lambda: fleet_db.find_expiring_documents(
+        today, (30, 7, -1), last_scan))
+    assert _uses(plans, "idx_documents_expiry"), plans
+    for plan in plans:
+        assert "SCAN d " not in plan and not plan.startswith("SCAN d"), plans
+        assert "SCAN documents" not in plan, plans
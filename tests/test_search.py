@@ -0,0 +1,30 @@
+import pytest
+
+
+@pytest.fixture
+def search_db(db):
+    db.bulk_add_vehicles([
+        ("تويوتا كامري", "أ ب ج 123", "2027-01-01", None),
+        ("هيونداي النترا", "د ه و 456", "2027-01-01", None),
+        ("نيسان 100%", "ز ح ط 789", None, None),
+    ])
+    return db
+
+
+def _plates(rows):
+    return sorted(row[1] for row in rows)
+
+
+@pytest.mark.parametrize("term", ["أ ب", "ب ج", "اب", "أب ج", "ج 12",
+                                  "123", "كامري"])
+def test_finds_vehicle_by_partial_name_or_plate(search_db, term):
+    assert "أ ب ج 123" in _plates(search_db.search_vehicles(term))
+
+
+def test_like_wildcards_are_literal(search_db):
+    assert _plates(search_db.search_vehicles("%")) == ["ز ح ط 789"]
+    assert search_db.search_vehicles("_") == []
+
+
+def test_limit(search_db):
+    assert len(search_db.search_vehicles("ا", limit=1)) == 1
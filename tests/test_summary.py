@@ -0,0 +1,96 @@
+import datetime
+
+TODAY = datetime.date.today()
+
+
+def _day(offset):
+    return TODAY + datetime.timedelta(days=offset)
+
+
+def _counted(db):
+    # get_status_summary() recomputed from every vehicle's documents.
+    today = db._to_day(TODAY)
+    near = today + db.NEAR_EXPIRY_DAYS
+    with db.get_conn() as conn:
+        total, expired, near_expiry, valid = conn.execute(
+            """SELECT count(*),
+                      count(*) FILTER (WHERE earliest < ?1),
+                      count(*) FILTER (WHERE earliest BETWEEN ?1 AND ?2),
+                      count(*) FILTER (WHERE earliest > ?2)
+               FROM (SELECT (SELECT min(expiry_day) FROM documents
+                             WHERE vehicle_id = vehicles.id) AS earliest
+                     FROM vehicles)""", (today, near)).fetchone()
+    return {"total": total, "expired": expired, "near_expiry": near_expiry,
+            "valid": valid}
+
+
+def _check(db):
+    db.invalidate_cache()
+    assert db.get_status_summary() == _counted(db)
+
+
+def test_summary_follows_every_kind_of_write(db):
+    db.bulk_add_vehicles([
+        ("تويوتا", "A1", _day(-10), _day(100)),
+        ("نيسان", "B2", _day(10), None),
+        ("هيونداي", "C3", None, None),
+        ("كيا", "D4", _day(200), _day(300)),
+        ("مازدا", "E5", _day(-900), _day(-800)),
+    ])
+    _check(db)
+    # earliest_expiry moves between statuses, to NULL and back from NULL.
+    db.update_vehicle("تويوتا", "A1", _day(50), _day(100))
+    _check(db)
+    db.update_vehicle("نيسان", "B2", None, None)
+    _check(db)
+    db.update_vehicle("هيونداي", "C3", _day(-1), None)
+    _check(db)
+    db.update_vehicle("كيا", "D4", _day(5), _day(300))
+    _check(db)
+    # Extra documents count as well, including on a vehicle with no dates.
+    db.set_document_expiry("B2", "inspection", _day(-5))
+    _check(db)
+    db.set_document_expiry("B2", "inspection", _day(400))
+    _check(db)
+    db.set_document_expiry("A1", "inspection", _day(-5))
+    _check(db)
+    db.set_document_expiry("A1", "inspection", None)
+    _check(db)
+    db.delete_vehicle("D4")
+    _check(db)
+    assert db.archive_vehicles(365, TODAY) == 1
+    _check(db)
+    db.delete_vehicle("A1", archive=True)
+    _check(db)
+    assert db.get_status_summary()["total"] == 2
+
+
+def test_extra_document_sets_status_everywhere(db):
+    import fleet
+    import notifier
+    db.add_vehicle("تويوتا", "A1", _day(400), _day(500))
+    db.add_vehicle("نيسان", "B2", _day(400), _day(500))
+    db.set_document_expiry("A1", "inspection", datetime.date(2001, 1, 1))
+    db.invalidate_cache()
+
+    assert db.get_status_summary() == {"total": 2, "expired": 1,
+                                       "near_expiry": 0, "valid": 1}
+    assert [row[1] for row in db.get_vehicles_by_status("expired")] == ["A1"]
+    assert [row[1] for row in db.list_vehicles(None, 50, "name",
+                                               "expired")[0]] == ["A1"]
+    snapshot = fleet.get_snapshot()
+    assert snapshot.status_counts() == db.get_status_summary()
+    frame = snapshot.frame("expired")
+    assert list(frame["رقم اللوحة"]) == ["A1"]
+    labels = snapshot.statuses(["B2", "A1", "Z9"])
+    assert list(labels[:2]) == ["صالحة", "منتهية"]
+    assert labels.isna()[2]
+    sent = []
+    notifier.run_scan([sent.extend])
+    assert [(n["plate"], n["document"], n["type"]) for n in sent] == [
+        ("A1", "inspection", "expired")]
+
+    db.set_document_expiry("A1", "inspection", _day(400))
+    db.invalidate_cache()
+    assert db.get_status_summary()["expired"] == 0
+    assert fleet.get_snapshot().status_counts()["expired"] == 0
@@ -0,0 +1,29 @@
+import datetime
+
+import utils
+
+
+def _frame(cache_key):
+    today = datetime.date.today()
+    return utils.documents_frame(
+        [("expired", "E1", "registration", today - datetime.timedelta(days=5)),
+         ("soon", "S1", "inspection", today + datetime.timedelta(days=3)),
+         ("expired 2", "E2", "insurance", today - datetime.timedelta(days=1)),
+         ("soon 2", "S2", "insurance", today + datetime.timedelta(days=2))],
+        cache_key=cache_key)
+
+
+def test_keyed_frame_output_is_cached():
+    df = _frame(("test", "keyed"))
+    assert (utils.get_document_notifications(df)
+            is utils.get_document_notifications(df))
+
+
+def test_derived_frames_do_not_share_cached_output():
+    df = _frame(("test", "derived"))
+    expired = df[df["vehicle"].str.startswith("expired")]
+    soon = df[df["vehicle"].str.startswith("soon")]
+    assert expired.shape == soon.shape
+    assert set(utils.get_document_notifications(expired)["type"]) == {
+        "expired"}
+    assert set(utils.get_document_notifications(soon)["type"]) == {"urgent"}
@@ -0,0 +1,36 @@
+import threading
+
+import pytest
+
+
+def test_queued_write_gives_up_when_the_writer_is_busy(db, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+
+    def long_job(conn):
+        started.set()
+        release.wait(5)
+
+    blocker = db._write(long_job, (), False, exclusive=True)
+    assert started.wait(5)
+    monkeypatch.setattr(db, "WRITE_TIMEOUT_MS", 50)
+    try:
+        with pytest.raises(db.DatabaseBusyError):
+            db.add_vehicle("تويوتا", "A1", "2030-01-01", None)
+    finally:
+        release.set()
+    blocker.result(5)
+    # The withdrawn write never runs.
+    db.add_vehicle("نيسان", "B2", "2030-01-01", None)
+    assert db.get_vehicle("A1") is None
+    assert db.count_vehicles() == 1
+
+
+def test_close_stops_the_writer_thread(db):
+    db.add_vehicle("تويوتا", "A1", "2030-01-01", None)
+    thread = db._writer._thread
+    db.close_all_connections()
+    assert not thread.is_alive()
+    assert db._writer._conn is None
+    db.initialize()
+    db.add_vehicle("نيسان", "B2", "2030-01-01", None)
+    assert db.count_vehicles() == 2
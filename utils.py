@@ -1,129 +1,203 @@
+import weakref
 
+import numpy as np
 import pandas as pd
-import plotly.express as px
 
-VEHICLE_COLUMNS_AR = ["اسم السيارة", "رقم اللوحة", "انتهاء الاستمارة", "انتهاء التأمين"]
-
-
-def color_row(row):
-    today = pd.Timestamp.now().normalize()
-    reg = pd.to_datetime(row["انتهاء الاستمارة"])
-    ins = pd.to_datetime(row["انتهاء التأمين"])
-    color = ""
-    if reg < today or ins < today:
-        color = "background-color: #ffcccc;"
-    elif (reg - today).days <= 30 or (ins - today).days <= 30:
-        color = "background-color: #fff3cd;"
-    else:
-        color = "background-color: #d4edda;"
-    return [color] * len(row)
+from cache import LRUCache, memoize
+from metrics import instrument
 
+VEHICLE_COLUMNS_AR = ["اسم السيارة", "رقم اللوحة", "انتهاء الاستمارة", "انتهاء التأمين"]
+EXPIRY_COLUMNS_AR = ["انتهاء الاستمارة", "انتهاء التأمين"]
+EXPIRY_DOCUMENTS_AR = ["استمارة", "تأمين"]
+
+URGENT_DAYS = 7
+WARNING_DAYS = 30
+
+TIMELINE_VEHICLE_LIMIT = 200
+TIMELINE_WEEKLY_SPAN_DAYS = 2 * 365
+
+STATUS_COLUMN_AR = "الحالة"
+STATUS_EXPIRED_AR = "منتهية"
+STATUS_NEAR_EXPIRY_AR = "قريبة من الانتهاء"
+STATUS_VALID_AR = "صالحة"
+STATUS_LABELS_AR = [STATUS_EXPIRED_AR, STATUS_NEAR_EXPIRY_AR, STATUS_VALID_AR]
+STATUS_STYLES = {
+    STATUS_EXPIRED_AR: "background-color: #ffcccc;",
+    STATUS_NEAR_EXPIRY_AR: "background-color: #fff3cd;",
+    STATUS_VALID_AR: "background-color: #d4edda;",
+}
+STATUS_CHART_COLORS = {
+    STATUS_EXPIRED_AR: "#ff6b6b",
+    STATUS_NEAR_EXPIRY_AR: "#ffd93d",
+    STATUS_VALID_AR: "#6bcf7f",
+}
+
+NOTIFICATION_COLUMNS = ["type", "document", "days", "vehicle", "plate"]
+NOTIFICATION_MESSAGES = {
+    ("expired", "registration"): "🔴 السيارة {vehicle} - انتهت الاستمارة منذ {days} يوم",
+    ("urgent", "registration"): "🟠 السيارة {vehicle} - تنتهي الاستمارة خلال {days} يوم",
+    ("warning", "registration"): "🟡 السيارة {vehicle} - تنتهي الاستمارة خلال {days} يوم",
+    ("expired", "insurance"): "🔴 السيارة {vehicle} - انتهى التأمين منذ {days} يوم",
+    ("urgent", "insurance"): "🟠 السيارة {vehicle} - ينتهي التأمين خلال {days} يوم",
+    ("warning", "insurance"): "🟡 السيارة {vehicle} - ينتهي التأمين خلال {days} يوم",
+    ("expired", "inspection"): "🔴 السيارة {vehicle} - انتهى الفحص الدوري منذ {days} يوم",
+    ("urgent", "inspection"): "🟠 السيارة {vehicle} - ينتهي الفحص الدوري خلال {days} يوم",
+    ("warning", "inspection"): "🟡 السيارة {vehicle} - ينتهي الفحص الدوري خلال {days} يوم",
+    ("expired", "operating_card"): "🔴 السيارة {vehicle} - انتهت بطاقة التشغيل منذ {days} يوم",
+    ("urgent", "operating_card"): "🟠 السيارة {vehicle} - تنتهي بطاقة التشغيل خلال {days} يوم",
+    ("warning", "operating_card"): "🟡 السيارة {vehicle} - تنتهي بطاقة التشغيل خلال {days} يوم",
+    ("expired", "driver_permit"): "🔴 السيارة {vehicle} - انتهت رخصة السائق منذ {days} يوم",
+    ("urgent", "driver_permit"): "🟠 السيارة {vehicle} - تنتهي رخصة السائق خلال {days} يوم",
+    ("warning", "driver_permit"): "🟡 السيارة {vehicle} - تنتهي رخصة السائق خلال {days} يوم",
+}
+DOCUMENT_LABELS_AR = {
+    "registration": "الاستمارة",
+    "insurance": "التأمين",
+    "inspection": "الفحص الدوري",
+    "operating_card": "بطاقة التشغيل",
+    "driver_permit": "رخصة السائق",
+}
+DOCUMENT_COLUMNS = ["vehicle", "plate", "document", "expiry"]
+
+
+_output_cache = LRUCache()
+_keyed_frames = weakref.WeakValueDictionary()
+
+
+def set_cache_key(df, cache_key):
+    # pandas copies attrs into every frame derived from df (df[mask],
+    # df.head(), ...), so the key is only trusted on the frame it was set on.
+    df.attrs["cache_key"] = cache_key
+    _keyed_frames[id(df)] = df
+
+
+@instrument
+def vehicles_frame(rows, cache_key=None):
+    df = pd.DataFrame(rows, columns=VEHICLE_COLUMNS_AR)
+    for col in EXPIRY_COLUMNS_AR:
+        df[col] = pd.to_datetime(
+            np.array(df[col].tolist(), dtype="datetime64[D]"))
+    if cache_key is not None:
+        set_cache_key(df, cache_key)
+    return df
+
+
+def documents_frame(rows, cache_key=None):
+    # Long form: one row per (vehicle, document), as returned by
+    # database.get_expiring_documents().
+    df = pd.DataFrame(rows, columns=DOCUMENT_COLUMNS)
+    df["expiry"] = pd.to_datetime(
+        np.array(df["expiry"].tolist(), dtype="datetime64[D]"))
+    if cache_key is not None:
+        set_cache_key(df, cache_key)
+    return df
+
+
+def _output_key(func, args, kwargs):
+    # Only frames given a cache_key through set_cache_key (normally the
+    # query plus database.data_version()) are cached. Columns may still be
+    # added to them in place, so the shape is part of the key as well.
+    df = args[0]
+    cache_key = df.attrs.get("cache_key")
+    if cache_key is None or _keyed_frames.get(id(df)) is not df:
+        return None
+    return (func.__name__, cache_key, df.shape, tuple(df.columns), args[1:],
+            tuple(sorted(kwargs.items())), pd.Timestamp.now().normalize())
+
+
+_cached_output = memoize(_output_cache, _output_key)
+
+
+def expiry_days(df, columns=EXPIRY_COLUMNS_AR, today=None):
+    today = pd.Timestamp.now().normalize() if today is None else pd.Timestamp(today)
+    dates = np.column_stack([
+        pd.to_datetime(df[col], errors="coerce", format="ISO8601")
+        .to_numpy().astype("datetime64[D]")
+        for col in columns
+    ])
+    delta = dates - np.datetime64(today.date(), "D")
+    return delta.astype("int64"), np.isnat(delta)
+
+
+def classify_expiry_days(days, missing, warning_days=WARNING_DAYS):
+    # Status codes into STATUS_LABELS_AR (-1 when a vehicle has no date)
+    # from a (vehicles, documents) array of days until expiry.
+    earliest = np.where(missing, np.iinfo(np.int64).max, days).min(axis=1)
+    return np.select(
+        [missing.all(axis=1), earliest < 0, earliest <= warning_days],
+        [-1, 0, 1],
+        default=2
+    ).astype(np.int8)
+
+
+@instrument
+def color_rows(df, status=None):
+    # status defaults to the frame's own status column.
+    if status is None:
+        status = df[STATUS_COLUMN_AR]
+    colors = (pd.Series(status).map(STATUS_STYLES).astype(object)
+              .fillna("").to_numpy())
+    return pd.DataFrame(np.repeat(colors[:, None], len(df.columns), axis=1),
+                        index=df.index, columns=df.columns)
+
+
+def _notifications(days, documents, vehicles, plates, urgent_days,
+                   warning_days):
+    kinds = np.select(
+        [days < 0, days <= urgent_days, days <= warning_days],
+        ["expired", "urgent", "warning"],
+        default=""
+    )
+    keep = kinds != ""
+    notifications = pd.DataFrame({
+        "type": kinds[keep],
+        "document": documents[keep],
+        "days": days[keep],
+        "vehicle": vehicles[keep],
+        "plate": plates[keep],
+    }, columns=NOTIFICATION_COLUMNS)
+    return notifications.sort_values("days", kind="stable", ignore_index=True)
+
+
+@instrument
+@_cached_output
+def get_document_notifications(df, today=None, urgent_days=URGENT_DAYS,
+                               warning_days=WARNING_DAYS):
+    # One row per (vehicle, document) of a documents_frame, so any
+    # document type is handled by the same code.
+    if df.empty:
+        return pd.DataFrame(columns=NOTIFICATION_COLUMNS)
 
-def save_to_excel(df):
-    try:
-        output = "vehicles_export.xlsx"
-        df.to_excel(output, index=False)
-        return output
-    except Exception as e:
-        raise ValueError(f"خطأ في تصدير البيانات: {str(e)}")
-
+    days, missing = expiry_days(df, ["expiry"], today=today)
+    rows = np.flatnonzero(~missing[:, 0])
+    return _notifications(days[rows, 0], df["document"].to_numpy()[rows],
+                          df["vehicle"].to_numpy()[rows],
+                          df["plate"].to_numpy()[rows],
+                          urgent_days, warning_days)
 
-def get_expiry_notifications(df):
-    if df.empty:
-        return []
 
-    today = pd.Timestamp.now().normalize()
-    notifications = []
-
-    for _, row in df.iterrows():
-        reg_expiry = pd.to_datetime(row["انتهاء الاستمارة"])
-        ins_expiry = pd.to_datetime(row["انتهاء التأمين"])
-
-        reg_days = (reg_expiry - today).days
-        ins_days = (ins_expiry - today).days
-
-        if reg_days < 0:
-            notifications.append({
-                "type": "expired",
-                "message": f"🔴 السيارة {row['اسم السيارة']} - "
-                           f"انتهت الاستمارة منذ {abs(reg_days)} يوم",
-                "vehicle": row['اسم السيارة'],
-                "plate": row['رقم اللوحة']
-            })
-        elif reg_days <= 7:
-            notifications.append({
-                "type": "urgent",
-                "message": f"🟠 السيارة {row['اسم السيارة']} - "
-                           f"تنتهي الاستمارة خلال {reg_days} يوم",
-                "vehicle": row['اسم السيارة'],
-                "plate": row['رقم اللوحة']
-            })
-        elif reg_days <= 30:
-            notifications.append({
-                "type": "warning",
-                "message": f"🟡 السيارة {row['اسم السيارة']} - "
-                           f"تنتهي الاستمارة خلال {reg_days} يوم",
-                "vehicle": row['اسم السيارة'],
-                "plate": row['رقم اللوحة']
-            })
-
-        if ins_days < 0:
-            notifications.append({
-                "type": "expired",
-                "message": f"🔴 السيارة {row['اسم السيارة']} - "
-                           f"انتهى التأمين منذ {abs(ins_days)} يوم",
-                "vehicle": row['اسم السيارة'],
-                "plate": row['رقم اللوحة']
-            })
-        elif ins_days <= 7:
-            notifications.append({
-                "type": "urgent",
-                "message": f"🟠 السيارة {row['اسم السيارة']} - "
-                           f"ينتهي التأمين خلال {ins_days} يوم",
-                "vehicle": row['اسم السيارة'],
-                "plate": row['رقم اللوحة']
-            })
-        elif ins_days <= 30:
-            notifications.append({
-                "type": "warning",
-                "message": f"🟡 السيارة {row['اسم السيارة']} - "
-                           f"ينتهي التأمين خلال {ins_days} يوم",
-                "vehicle": row['اسم السيارة'],
-                "plate": row['رقم اللوحة']
-            })
-
-    return notifications
+def format_notification(notification):
+    template = NOTIFICATION_MESSAGES[(notification["type"],
+                                      notification["document"])]
+    return template.format(vehicle=notification["vehicle"],
+                           days=abs(int(notification["days"])))
 
 
+@instrument
+@_cached_output
 def create_status_chart(df):
+    # Imported here so pages without charts never load Plotly.
+    import plotly.express as px
     if df.empty:
         return None
 
-    today = pd.Timestamp.now().normalize()
-    expired_count = 0
-    near_expiry_count = 0
-    valid_count = 0
-
-    for _, row in df.iterrows():
-        reg_expiry = pd.to_datetime(row["انتهاء الاستمارة"])
-        ins_expiry = pd.to_datetime(row["انتهاء التأمين"])
-
-        if reg_expiry < today or ins_expiry < today:
-            expired_count += 1
-        elif ((reg_expiry - today).days <= 30 or
-              (ins_expiry - today).days <= 30):
-            near_expiry_count += 1
-        else:
-            valid_count += 1
+    counts = df[STATUS_COLUMN_AR].value_counts().reindex(STATUS_LABELS_AR, fill_value=0)
 
     fig = px.pie(
-        values=[expired_count, near_expiry_count, valid_count],
-        names=["منتهية", "قريبة من الانتهاء", "صالحة"],
-        color_discrete_map={
-            "منتهية": "#ff6b6b",
-            "قريبة من الانتهاء": "#ffd93d",
-            "صالحة": "#6bcf7f"
-        },
+        values=counts.to_numpy(),
+        names=STATUS_LABELS_AR,
+        color=STATUS_LABELS_AR,
+        color_discrete_map=STATUS_CHART_COLORS,
         title="توزيع حالة السيارات"
     )
 
@@ -137,49 +211,109 @@ def create_status_chart(df):
     return fig
 
 
-def create_expiry_timeline(df):
-    if df.empty:
+def timeline_frequency(df):
+    # None keeps the per-vehicle view; larger fleets are binned weekly, or
+    # monthly when the expiry dates span more than two years.
+    if len(df) <= TIMELINE_VEHICLE_LIMIT:
         return None
+    days, missing = expiry_days(df)
+    if missing.all():
+        return "W"
+    span = days[~missing].max() - days[~missing].min()
+    return "M" if span > TIMELINE_WEEKLY_SPAN_DAYS else "W"
 
-    timeline_data = []
-    today = pd.Timestamp.now().normalize()
 
-    for _, row in df.iterrows():
-        reg_expiry = pd.to_datetime(row["انتهاء الاستمارة"])
-        ins_expiry = pd.to_datetime(row["انتهاء التأمين"])
+def _bin_starts(dates, freq):
+    if freq == "M":
+        return dates.astype("datetime64[M]").astype("datetime64[D]")
+    # 1970-01-01 was a Thursday; shift so every week starts on Monday.
+    return dates - (dates.astype("int64") + 3) % 7
 
-        timeline_data.append({
-            "السيارة": row['اسم السيارة'],
-            "النوع": "استمارة",
-            "تاريخ الانتهاء": reg_expiry,
-            "الأيام المتبقية": (reg_expiry - today).days
-        })
 
-        timeline_data.append({
-            "السيارة": row['اسم السيارة'],
-            "النوع": "تأمين",
-            "تاريخ الانتهاء": ins_expiry,
-            "الأيام المتبقية": (ins_expiry - today).days
-        })
+def _expiry_dates(df, today):
+    days, missing = expiry_days(df, today=today)
+    return np.datetime64(today.date(), "D") + days, missing
 
-    timeline_df = pd.DataFrame(timeline_data)
-    timeline_df = timeline_df.sort_values("تاريخ الانتهاء")
+
+@instrument
+def timeline_bin_vehicles(df, start, freq):
+    today = pd.Timestamp.now().normalize()
+    dates, missing = _expiry_dates(df, today)
+    in_bin = (_bin_starts(dates, freq) == np.datetime64(str(start)[:10], "D"))
+    return df[(in_bin & ~missing).any(axis=1)]
+
+
+def _vehicle_timeline(df, today):
+    import plotly.express as px
+    dates, missing = _expiry_dates(df, today)
+    rows, cols = np.nonzero(~missing)
+    timeline_df = pd.DataFrame({
+        "السيارة": df["اسم السيارة"].to_numpy()[rows],
+        "النوع": np.array(EXPIRY_DOCUMENTS_AR)[cols],
+        "تاريخ الانتهاء": dates[rows, cols],
+        "الأيام المتبقية": (dates[rows, cols]
+                            - np.datetime64(today.date(), "D")).astype("int64"),
+    }).sort_values("تاريخ الانتهاء", kind="stable")
 
     fig = px.scatter(
         timeline_df,
         x="تاريخ الانتهاء",
         y="السيارة",
         color="النوع",
-        size="الأيام المتبقية",
         hover_data=["الأيام المتبقية"],
+        render_mode="webgl",
         title="الجدول الزمني لانتهاء الصلاحيات"
     )
+    fig.update_layout(yaxis_title="السيارة")
+    return fig
+
+
+def _binned_timeline(df, today, freq):
+    import plotly.express as px
+    dates, missing = _expiry_dates(df, today)
+    starts = _bin_starts(dates, freq)
+    frames = []
+    for col, document in enumerate(EXPIRY_DOCUMENTS_AR):
+        bins, counts = np.unique(starts[~missing[:, col], col],
+                                 return_counts=True)
+        frames.append(pd.DataFrame({"الفترة": bins, "النوع": document,
+                                    "عدد السيارات": counts}))
+    timeline_df = pd.concat(frames, ignore_index=True)
+
+    period = "شهري" if freq == "M" else "أسبوعي"
+    fig = px.bar(
+        timeline_df,
+        x="الفترة",
+        y="عدد السيارات",
+        color="النوع",
+        title=f"الجدول الزمني لانتهاء الصلاحيات ({period})"
+    )
+    fig.update_layout(barmode="stack", yaxis_title="عدد السيارات",
+                      clickmode="event+select")
+    fig.add_vline(x=today, line_dash="dash", line_color="#ff6b6b")
+    return fig
+
+
+@instrument
+@_cached_output
+def create_expiry_timeline(df):
+    if df.empty:
+        return None
+
+    # The per-vehicle view needs one y-axis row per vehicle, so it is only
+    # used for small fleets; the binned view stays a few hundred bars at
+    # most whatever the fleet size.
+    today = pd.Timestamp.now().normalize()
+    freq = timeline_frequency(df)
+    if freq is None:
+        fig = _vehicle_timeline(df, today)
+    else:
+        fig = _binned_timeline(df, today, freq)
 
     fig.update_layout(
         font=dict(size=12),
         height=500,
-        xaxis_title="تاريخ الانتهاء",
-        yaxis_title="السيارة"
+        xaxis_title="تاريخ الانتهاء"
     )
 
     return fig